@@ -1,3 +1,5 @@
+import dataclasses
+import functools
 import os
 import cv2
 from typing import Iterator, Tuple, Any
@@ -7,21 +9,73 @@ import pickle
 import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
-import tensorflow_hub as hub
 import re
 
+from conversion_utils import settings
+from conversion_utils.columnar import is_sidecar, load_pickle
+from conversion_utils.discovery import find_episodes
+from conversion_utils.embedding import load_embed
+from conversion_utils.embedding_server import embedding_server_model
+from conversion_utils.embedding_storage import embedding_features, quantize_embedding
+from conversion_utils.images import encoded_padding, load_frames, padding
+from conversion_utils.parallel import parse_builder_episodes, parse_episodes
+from conversion_utils.search_index import index_examples
+
+# encoding of the image feature the frames of each camera folder are stored in
+CAMERA_ENCODINGS = {
+    'depth_images0': 'png',
+    'images0': 'jpeg',
+    'images1': 'jpeg',
+    'images2': 'jpeg',
+    'images3': 'jpeg',
+}
+
+# encoding of the image feature of each observation
+IMAGE_ENCODINGS = {
+    'depth_0': 'png',
+    'image_0': 'jpeg',
+    'image_1': 'jpeg',
+    'image_2': 'jpeg',
+    'image_3': 'jpeg',
+}
+
+@dataclasses.dataclass
+class BridgeConfig(tfds.core.BuilderConfig):
+    """Schema variant of the bridge dataset, every variant is built into its own directory."""
+    # store the language instructions and embedding once in episode_metadata instead of in every step
+    episode_language: bool = False
+    # embed all 12 lupus instructions of an episode in one call and store them as episode_metadata/language_embeddings
+    embed_all_instructions: bool = False
+    # storage dtype of the language embeddings: float32, float16 or int8 (with a float32 scale per vector)
+    embedding_dtype: str = 'float32'
+
 class Bridge(tfds.core.GeneratorBasedBuilder):
     """DatasetBuilder for example dataset."""
 
-    VERSION = tfds.core.Version('1.0.1')
+    VERSION = tfds.core.Version('1.0.2')
     RELEASE_NOTES = {
       '1.0.0': 'Initial release.',
       '1.0.1': 'Changed BGR to RGB.',
+      '1.0.2': 'Episodes without lupus instruction have a zero language embedding.',
     }
+    # a plain tfds build builds every config, build one with tfds build --config <name>
+    BUILDER_CONFIGS = [
+        BridgeConfig(name='default',
+                     description='Language instructions and embedding in every step.'),
+        BridgeConfig(name='episode_language',
+                     description='Language instructions and embedding once per episode in episode_metadata.',
+                     episode_language=True),
+        BridgeConfig(name='all_instructions',
+                     description='Embeddings of all lupus instructions in episode_metadata/language_embeddings.',
+                     embed_all_instructions=True),
+        BridgeConfig(name='float16', description='float16 language embeddings.', embedding_dtype='float16'),
+        BridgeConfig(name='int8', description='int8 language embeddings with a float32 scale per vector.',
+                     embedding_dtype='int8'),
+    ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder-large/5")
+        self._embed = load_embed()
 
     def _info(self) -> tfds.core.DatasetInfo:
         """Dataset metadata (homepage, citation,...)."""
@@ -113,108 +167,7 @@ class Bridge(tfds.core.GeneratorBasedBuilder):
                         dtype=np.bool_,
                         doc='True on last step of the episode if it is a terminal step, True for demos.'
                     ),
-                    'language_instruction': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_1': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_2': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_3': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_4': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_5': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_6': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_7': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_8': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_9': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_10': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_instruction_11': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_1': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_2': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_3': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_4': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_5': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_6': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_7': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_8': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_9': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_10': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'groundtruth_11': tfds.features.Text(
-                        doc='Language Instruction. utf-8 encoded data from files'
-                            'empty byte stream if has_language is false'
-                    ),
-                    'language_embedding': tfds.features.Tensor(
-                        shape=(1, 512),
-                        dtype=np.float32,
-                        doc='Kona language embedding. '
-                            'See https://tfhub.dev/google/universal-sentence-encoder-large/5'
-                    )
+                    **_step_language_features(self.builder_config),
                 }),
                 'episode_metadata': tfds.features.FeaturesDict({
                     'file_path': tfds.features.Text(
@@ -247,7 +200,9 @@ class Bridge(tfds.core.GeneratorBasedBuilder):
                     'has_language': tfds.features.Scalar(
                         dtype=np.bool_,
                         doc='bool, true if dataset had language annotations, false if none (empty string in language_instruction as padding)'
-                    )
+                    ),
+                    **_lupus_embedding_features(self.builder_config),
+                    **_episode_language_features(self.builder_config),
                 }),
             }))
 
@@ -263,41 +218,187 @@ class Bridge(tfds.core.GeneratorBasedBuilder):
         """Generator of examples for each split."""
 
         # create list of all examples
-        raw_dirs = []
-        get_trajectorie_paths_recursive(path, raw_dirs)
-        raw_dirs.reverse()
-
-        # for smallish datasets, use single-thread parsing
-        counter = 0
-        end = len(raw_dirs)
-        for raw_dir in raw_dirs:
-            print(counter, " of ", end, " done")
-            counter += 1
-            for traj_group in os.listdir(raw_dir):
-                traj_group_full_path = os.path.join(raw_dir, traj_group)
-                if os.path.isdir(traj_group_full_path):
-                    for traj_dir in os.listdir(traj_group_full_path):
-                        traj_dir_full_path = os.path.join(traj_group_full_path, traj_dir)
-                        if os.path.isdir(traj_dir_full_path):
-                            example = _parse_example(traj_dir_full_path, self._embed)
-                            if example is not None:
-                                yield example
-                        else:
-                            print("non dir instead of traj found!")
-                            yield traj_dir_full_path, {}
-                else:
-                    print("non dir instead of traj_group found!")
-                    yield traj_group_full_path, {}
-
-        # for large datasets use beam to parallelize data parsing (this will have initialization overhead)
-        # beam = tfds.core.lazy_imports.apache_beam
-        # return (
-        #         beam.Create(episode_paths)
-        #         | beam.Map(_parse_example)
-        # )
-
-def _parse_example(episode_path, embed=None):
+        episode_paths = get_episode_paths(path)
+        print("# of trajectories:", len(episode_paths))
+
+        parse_fn = get_parse_fn(self.builder_config.name)
+        examples = parse_builder_episodes(self, episode_paths, parse_fn, __file__, IMAGE_ENCODINGS,
+                                          embed=self._embed, embed_loader=load_embed)
+        if settings.SEARCH_INDEX and settings.USE_BEAM:
+            # the examples are a Beam PTransform that the builder runs later, there is nothing to index here
+            print("RLDS_SEARCH_INDEX is ignored with RLDS_USE_BEAM, index the built dataset with "
+                  "python3 -m conversion_utils.search_episodes build")
+        elif settings.SEARCH_INDEX:
+            # search index of the language embeddings, see conversion_utils/search_episodes.py
+            index_dir = os.path.join(settings.SEARCH_INDEX, self.name, self.builder_config.name)
+            examples = index_examples(examples, index_dir, f"{self.name}/{self.builder_config.name}")
+        return examples
+
+def _step_language_features(config):
+    # language fields of every step, stored once in episode_metadata by the episode_language configs
+    if config.episode_language:
+        return {}
+    return {
+        'language_instruction': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_1': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_2': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_3': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_4': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_5': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_6': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_7': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_8': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_9': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_10': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'language_instruction_11': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_1': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_2': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_3': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_4': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_5': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_6': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_7': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_8': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_9': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_10': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        'groundtruth_11': tfds.features.Text(
+            doc='Language Instruction. utf-8 encoded data from files'
+                'empty byte stream if has_language is false'
+        ),
+        **embedding_features(
+            'language_embedding',
+            shape=(1, 512),
+            doc='Kona language embedding. '
+                'See https://tfhub.dev/google/universal-sentence-encoder-large/5',
+            dtype=config.embedding_dtype,
+        ),
+    }
+
+def _episode_language_features(config):
+    # episode level language fields of the episode_language configs, broadcast them to the steps with
+    # conversion_utils.episode_language.broadcast_language when reading
+    if not config.episode_language:
+        return {}
+    return {
+        'language_instructions': tfds.features.Sequence(
+            tfds.features.Text(),
+            length=12,
+            doc='The 12 lupus language instructions (language_instruction to language_instruction_11 of the '
+                'per step schema). utf-8 encoded data from files, empty byte streams if has_language is false'
+        ),
+        'groundtruths': tfds.features.Sequence(
+            tfds.features.Text(),
+            length=12,
+            doc='The 12 groundtruth instructions (groundtruth to groundtruth_11 of the per step schema). '
+                'utf-8 encoded data from files, empty byte streams if lang.txt is missing'
+        ),
+        **embedding_features(
+            'language_embedding',
+            shape=(1, 512),
+            doc='Kona language embedding. '
+                'See https://tfhub.dev/google/universal-sentence-encoder-large/5',
+            dtype=config.embedding_dtype,
+        ),
+    }
+
+def _lupus_embedding_features(config):
+    # episode tensor of the embeddings of all lupus instructions, only for the all_instructions configs
+    if not config.embed_all_instructions:
+        return {}
+    return embedding_features(
+        'language_embeddings',
+        shape=(12, 512),
+        doc='Kona language embeddings of language_instruction to language_instruction_11, zeros '
+            'if has_language is false. See https://tfhub.dev/google/universal-sentence-encoder-large/5',
+        dtype=config.embedding_dtype,
+    )
+
+def get_parse_fn(config_name='default'):
+    # _parse_example for the schema of a builder config, picklable for the worker processes
+    config = {config.name: config for config in Bridge.BUILDER_CONFIGS}[config_name]
+    return functools.partial(_parse_example, episode_language=config.episode_language,
+                             embed_all_instructions=config.embed_all_instructions,
+                             embedding_dtype=config.embedding_dtype)
+
+def get_episode_paths(path):
+    # episodes are stored in <...>/raw/<traj_group>/<traj>
+    return find_episodes(path, "raw", episode_depth=2, manifest_dir=settings.MANIFEST_DIR,
+                         num_threads=settings.DISCOVERY_THREADS)
+
+def _parse_example(episode_path, embed=None, episode_language=False, embed_all_instructions=False,
+                   embedding_dtype='float32'):
     data = {}
+    frame_paths = {}
 
     # check if "lang_lupus" exists in traj
     lupus_path = os.path.join(episode_path, "annotations", "lang_lupus.txt")
@@ -307,6 +408,9 @@ def _parse_example(episode_path, embed=None):
 
     for data_field in os.listdir(episode_path):
         data_field_full_path = os.path.join(episode_path, data_field)
+        if is_sidecar(data_field):
+            # columnar sidecar of a pickle, read by load_pickle
+            continue
         if os.path.isdir(data_field_full_path):
             if data_field == "annotations": # extract "lang_lupus"
                 for lupus_annotation in os.listdir(data_field_full_path):
@@ -315,14 +419,17 @@ def _parse_example(episode_path, embed=None):
                             lang_lupus = {"lang_lupus": f.read()}
                             data.update(lang_lupus)
             else:
-                cam1_image_vector = create_img_vector(data_field_full_path)
-                data.update({data_field: cam1_image_vector})
+                frame_paths[data_field] = get_img_paths(data_field_full_path)
         elif data_field == "lang.txt":
             with open(data_field_full_path, 'rb') as f:
                 lang_txt = {"lang": f.read()}
                 data.update(lang_txt)
         else:
-            data.update({data_field[:data_field.find(".")]: np.load(data_field_full_path, allow_pickle=True)})
+            # memory mapped from the sidecar written by conversion_utils/convert_pickles.py if there is one
+            data.update({data_field[:data_field.find(".")]: load_pickle(data_field_full_path)})
+
+    features = {cam: ((480, 640, 3), encoding) for cam, encoding in CAMERA_ENCODINGS.items()}
+    data.update(load_frames(frame_paths, settings.DECODE_THREADS, features, settings.PASSTHROUGH, settings.ENCODE_FRAMES))
 
     # agent_data : dict_keys(['traj_ok', 'camera_info', 'term_t', 'stats'])
     # policy_out : dict_keys(['actions', 'new_robot_transform', 'delta_robot_transform', 'policy_type'])
@@ -362,23 +469,68 @@ def _parse_example(episode_path, embed=None):
             for i in range(to_fill):
                 lang_array.append(lang_array[i])
 
-    pad_img_tensor = tf.ones([480, 640, 3], dtype=np.uint8).numpy()
+    pad_img_tensor = padding((480, 640, 3))
+    pad_depth_tensor = pad_img_tensor
+    if settings.ENCODE_FRAMES:
+        pad_img_tensor = encoded_padding((480, 640, 3), 'jpeg')
+        pad_depth_tensor = encoded_padding((480, 640, 3), 'png')
     # pad_depth_tensor = tf.ones([480, 640, 1], dtype=data["images0"][0].dtype).numpy()
 
+    # compute Kona language embedding, once per episode since the instruction is the same for every step.
+    # with embed_all_instructions, all 12 lupus instructions are embedded in the same encoder call
+    lupus_embeddings = np.zeros((12, 512), dtype=np.float32)
+    if embed is None:
+        language_embedding = [np.zeros(512)]
+    elif has_language and embed_all_instructions:
+        lupus_embeddings = embed(lupus_array[:12])
+        language_embedding = lupus_embeddings[:1]
+    elif has_language:
+        language_embedding = embed([lupus_array[0]])
+    else:
+        # zeros, without loading the encoder
+        language_embedding = embed([""])
+    # stored as float16 or int8 by the configs with that embedding_dtype
+    embedding_fields = quantize_embedding('language_embedding', language_embedding, embedding_dtype)
+
+    # the language fields are the same for every step, with episode_language they are stored once in
+    # episode_metadata instead of in every step
+    language_instructions = lupus_array[:12] if has_language else [b''] * 12
+    groundtruths = lang_array[:12] if has_groundtruth else [b''] * 12
+    step_language = {}
+    if not episode_language:
+        step_language = {
+            'language_instruction': language_instructions[0],
+            'language_instruction_1': language_instructions[1],
+            'language_instruction_2': language_instructions[2],
+            'language_instruction_3': language_instructions[3],
+            'language_instruction_4': language_instructions[4],
+            'language_instruction_5': language_instructions[5],
+            'language_instruction_6': language_instructions[6],
+            'language_instruction_7': language_instructions[7],
+            'language_instruction_8': language_instructions[8],
+            'language_instruction_9': language_instructions[9],
+            'language_instruction_10': language_instructions[10],
+            'language_instruction_11': language_instructions[11],
+            'groundtruth': groundtruths[0],
+            'groundtruth_1': groundtruths[1],
+            'groundtruth_2': groundtruths[2],
+            'groundtruth_3': groundtruths[3],
+            'groundtruth_4': groundtruths[4],
+            'groundtruth_5': groundtruths[5],
+            'groundtruth_6': groundtruths[6],
+            'groundtruth_7': groundtruths[7],
+            'groundtruth_8': groundtruths[8],
+            'groundtruth_9': groundtruths[9],
+            'groundtruth_10': groundtruths[10],
+            'groundtruth_11': groundtruths[11],
+            **embedding_fields,
+        }
+
     episode = []
     for i in range(trajectory_length):
-        # compute Kona language embedding
-        if embed is None:
-            language_embedding = [np.zeros(512)]
-        elif has_language:
-            lang_str = lupus_array[0].decode("utf-8")
-            language_embedding = embed([lang_str]).numpy()
-        else:
-            language_embedding = embed([""]).numpy()
-
         episode.append({
             'observation': {
-                "depth_0": data['depth_images0'][i] if has_depth_0 else pad_img_tensor,
+                "depth_0": data['depth_images0'][i] if has_depth_0 else pad_depth_tensor,
                 "image_0": data['images0'][i] if has_image_0 else pad_img_tensor,
                 "image_1": data['images1'][i] if has_image_1 else pad_img_tensor,
                 "image_2": data['images2'][i] if has_image_2 else pad_img_tensor,
@@ -395,31 +547,7 @@ def _parse_example(episode_path, embed=None):
             'is_first': i == 0,
             'is_last': i == (trajectory_length - 1),
             'is_terminal': i == (trajectory_length - 1),
-            'language_instruction': lupus_array[0] if has_language else b'',
-            'language_instruction_1': lupus_array[1] if has_language else b'',
-            'language_instruction_2': lupus_array[2] if has_language else b'',
-            'language_instruction_3': lupus_array[3] if has_language else b'',
-            'language_instruction_4': lupus_array[4] if has_language else b'',
-            'language_instruction_5': lupus_array[5] if has_language else b'',
-            'language_instruction_6': lupus_array[6] if has_language else b'',
-            'language_instruction_7': lupus_array[7] if has_language else b'',
-            'language_instruction_8': lupus_array[8] if has_language else b'',
-            'language_instruction_9': lupus_array[9] if has_language else b'',
-            'language_instruction_10': lupus_array[10] if has_language else b'',
-            'language_instruction_11': lupus_array[11] if has_language else b'',
-            'groundtruth': lang_array[0] if has_groundtruth else b'',
-            'groundtruth_1': lang_array[1] if has_groundtruth else b'',
-            'groundtruth_2': lang_array[2] if has_groundtruth else b'',
-            'groundtruth_3': lang_array[3] if has_groundtruth else b'',
-            'groundtruth_4': lang_array[4] if has_groundtruth else b'',
-            'groundtruth_5': lang_array[5] if has_groundtruth else b'',
-            'groundtruth_6': lang_array[6] if has_groundtruth else b'',
-            'groundtruth_7': lang_array[7] if has_groundtruth else b'',
-            'groundtruth_8': lang_array[8] if has_groundtruth else b'',
-            'groundtruth_9': lang_array[9] if has_groundtruth else b'',
-            'groundtruth_10': lang_array[10] if has_groundtruth else b'',
-            'groundtruth_11': lang_array[11] if has_groundtruth else b'',
-            'language_embedding': language_embedding,
+            **step_language,
         })
 
     # create output data sample
@@ -436,6 +564,13 @@ def _parse_example(episode_path, embed=None):
             'has_language': has_language,
         }
     }
+    if episode_language:
+        sample['episode_metadata']['language_instructions'] = language_instructions
+        sample['episode_metadata']['groundtruths'] = groundtruths
+        sample['episode_metadata'].update(embedding_fields)
+    if embed_all_instructions:
+        sample['episode_metadata'].update(
+            quantize_embedding('language_embeddings', lupus_embeddings, embedding_dtype))
 
     # if you want to skip an example for whatever reason, simply return None
     return episode_path, sample
@@ -461,49 +596,31 @@ def sorted_alphanumeric(data):
     alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ] 
     return sorted(data, key=alphanum_key)
 
-def create_img_vector(img_folder_path):
-    cam_list = []
+def get_img_paths(img_folder_path):
     cam_path_list = []
     dir_list_sorted = sorted_alphanumeric(os.listdir(img_folder_path))
     for img_name in dir_list_sorted:
         ext = img_name[img_name.find("."):]
         if ext == '.png' or ext == '.jpg' or ext == '.jpeg':
-            cam_path_list.append(img_name)
-            img_path = os.path.join(img_folder_path, img_name)
-            # img_array = cv2.imread(img_path)
-            img_array = cv2.cvtColor(cv2.imread(img_path), cv2.COLOR_RGB2BGR)
-            cam_list.append(img_array)
-    return cam_list
-
-def get_trajectorie_paths_recursive(directory, sub_dir_list):
-    for entry in os.listdir(directory):
-        full_path = os.path.join(directory, entry)
-        if os.path.isdir(full_path):
-            sub_dir_list.append(full_path) if entry == "raw" else get_trajectorie_paths_recursive(full_path, sub_dir_list)
-    # return subdirectories
+            cam_path_list.append(os.path.join(img_folder_path, img_name))
+    return cam_path_list
+
+def get_instructions(episode_path):
+    # lupus instructions of an episode, the only ones that are embedded (the lang.txt groundtruths are not), used by
+    # conversion_utils/precompute_embeddings.py
+    lupus_path = os.path.join(episode_path, "annotations", "lang_lupus.txt")
+    if not os.path.isfile(lupus_path):
+        return []
+    with open(lupus_path, 'rb') as f:
+        return preprocess_string(f.read().decode("utf-8"))
 
 if __name__ == "__main__":
     data_path = "/home/marcelr/BridgeData/raw"
-    embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder-large/5")
-    raw_dirs = []
-    counter = 0
-    get_trajectorie_paths_recursive(data_path, raw_dirs)
-    raw_dirs.reverse() # '/home/marcelr/BridgeData/raw/datacol1_toykitchen1/many_skills/09/2023-03-15_15-11-20/raw' '/home/marcelr/BridgeData/raw/datacol1_toykitchen1/many_skills/09/2023-03-15_15-11-20/raw'
-    for raw_dir in raw_dirs:
-        for traj_group in os.listdir(raw_dir):
-            traj_group_full_path = os.path.join(raw_dir, traj_group)
-            if os.path.isdir(traj_group_full_path):
-                for traj_dir in os.listdir(traj_group_full_path):
-                    traj_dir_full_path = os.path.join(traj_group_full_path, traj_dir)
-                    if os.path.isdir(traj_dir_full_path):
-                        counter += 1
-                        _parse_example(traj_dir_full_path, embed)
-                        print(counter)
-                    else:
-                        print("non dir instead of traj found!")
-            else:
-                print("non dir instead of traj_group found!")
-    # create list of all examples
-    # episode_paths = glob.glob(data_path)
-    # for episode in episode_paths:
-    #     _, sample = _parse_example(episode, embed)
\ No newline at end of file
+    embed = load_embed()
+    # '/home/marcelr/BridgeData/raw/datacol1_toykitchen1/many_skills/09/2023-03-15_15-11-20/raw/<traj_group>/<traj>'
+    for counter, _ in enumerate(parse_episodes(get_episode_paths(data_path), _parse_example, embed=embed, embed_loader=load_embed,
+                                               num_workers=settings.NUM_WORKERS, ordered=settings.ORDERED,
+                                               shared_memory=settings.SHARED_MEMORY, num_cpus=settings.NUM_CPUS,
+                                               embedding_server=embedding_server_model(),
+                                               embedding_server_threads=settings.EMBEDDING_SERVER_THREADS)):
+        print(counter + 1)
@@ -1,10 +1,20 @@
 import os
 import csv
+import argparse
 
+import numpy as np
 
-if __name__ == "__main__":
-    csv_path = "/home/marcelr/BridgeData"
-    output_dict = {}
+# Maps the lupus labels to the bridge labels of the same episodes and writes them to mapping.csv.
+# With --mode embedding, near-duplicate bridge labels (cosine similarity of their language embeddings >= --threshold)
+# are clustered as well, so that e.g. "put pot on burner" and "put the pot on the burner" share a row. The lupus labels
+# follow the bridge labels of their episodes into their clusters.
+# Run from the repo root for the embedding mode, e.g.:
+#   python3 -m bridge.create_mapping --mode embedding --table <table_dir>
+
+
+def read_labels(csv_path):
+    # (bridge label, lupus labels) of every episode
+    episodes = []
     with open(os.path.join(csv_path, "lang_lupus.csv"), newline='') as csv_lupus, open(os.path.join(csv_path, "lang_text.csv"), newline='') as csv_text:
         reader_lupus = csv.DictReader(csv_lupus, delimiter=';')
         reader_text = csv.DictReader(csv_text, delimiter=';')
@@ -12,13 +22,117 @@ if __name__ == "__main__":
             if row_lupus["file_name"] != row_text["file_name"]:
                 print("Error, non matching names!")
             else:
-                if not row_text["language_instruction_0"] in output_dict:
-                    output_dict[row_text["language_instruction_0"]] = []
+                lupus_labels = []
                 for i in range(15):
-                    if row_lupus["language_instruction_" + str(i)] != "" and not row_lupus["language_instruction_" + str(i)] in output_dict[row_text["language_instruction_0"]]:
-                        output_dict[row_text["language_instruction_0"]].append(row_lupus["language_instruction_" + str(i)])
+                    if row_lupus["language_instruction_" + str(i)] != "":
+                        lupus_labels.append(row_lupus["language_instruction_" + str(i)])
                     else:
                         break
+                episodes.append((row_text["language_instruction_0"], lupus_labels))
+    return episodes
+
+
+def exact_mapping(episodes):
+    # dicts as ordered sets, list membership checks are quadratic
+    output_dict = {}
+    for bridge_label, lupus_labels in episodes:
+        lupus_set = output_dict.setdefault(bridge_label, {})
+        for lupus_label in lupus_labels:
+            if lupus_label in lupus_set:
+                break
+            lupus_set[lupus_label] = None
+    return {bridge_label: list(lupus_set) for bridge_label, lupus_set in output_dict.items()}
+
+
+def embed_texts(texts, table_dir=None, batch_size=1024):
+    if table_dir:
+        from conversion_utils.embedding import EmbeddingTable
+        encoder = EmbeddingTable(table_dir)
+    else:
+        from conversion_utils import settings
+        from conversion_utils.embedding import LazyEncoder
+        encoder = LazyEncoder(settings.EMBEDDING_MODEL)
+    embeddings = np.concatenate([np.asarray(encoder(texts[start:start + batch_size]), dtype=np.float32)
+                                 for start in range(0, len(texts), batch_size)])
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def union(parents, i, j):
+    root_i, root_j = find(parents, i), find(parents, j)
+    if root_i != root_j:
+        parents[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def embedding_mapping(episodes, threshold, table_dir=None, block_size=4096):
+    # union-find over the distinct bridge labels, bridge labels with a cosine similarity >= threshold are joined.
+    # the lupus labels never join clusters, they follow the bridge label of their episode into its cluster, so a
+    # generic paraphrase shared by unrelated bridge labels does not join them
+    bridge_counts = {}
+    for bridge_label, lupus_labels in episodes:
+        bridge_counts[bridge_label] = bridge_counts.get(bridge_label, 0) + 1
+    bridge_labels = list(bridge_counts)
+    parents = list(range(len(bridge_labels)))
+
+    embeddings = embed_texts(bridge_labels, table_dir)
+    num_pairs = 0
+    for start in range(0, len(bridge_labels), block_size):
+        for other_start in range(start, len(bridge_labels), block_size):
+            # block of the similarity matrix, only the pairs above the diagonal
+            similarities = embeddings[start:start + block_size] @ embeddings[other_start:other_start + block_size].T
+            block_rows, other_rows = np.nonzero(np.triu(similarities >= threshold, k=1) if other_start == start
+                                                else similarities >= threshold)
+            num_pairs += len(block_rows)
+            for i, j in zip(block_rows + start, other_rows + other_start):
+                union(parents, i, j)
+    print(num_pairs, "near-duplicate bridge label pairs with similarity >=", threshold)
+
+    rows = {text: row for row, text in enumerate(bridge_labels)}
+    clusters = {}
+    for text in bridge_labels:
+        clusters.setdefault(find(parents, rows[text]), []).append(text)
+    # lupus label counts of the episodes of every cluster
+    lupus_counts = {}
+    for bridge_label, lupus_labels in episodes:
+        cluster_counts = lupus_counts.setdefault(find(parents, rows[bridge_label]), {})
+        for lupus_label in lupus_labels:
+            cluster_counts[lupus_label] = cluster_counts.get(lupus_label, 0) + 1
+
+    output_dict = {}
+    for root, cluster in clusters.items():
+        # the most frequent bridge label represents the cluster, the other bridge labels and the lupus labels of
+        # the episodes of the cluster are mapped to it
+        bridge_label = max(cluster, key=lambda text: bridge_counts[text])
+        counts = dict(lupus_counts.get(root, {}))
+        for text in cluster:
+            if text != bridge_label:
+                counts[text] = max(counts.get(text, 0), bridge_counts[text])
+        counts.pop(bridge_label, None)
+        output_dict[bridge_label] = sorted(counts, key=lambda text: -counts[text])
+    return output_dict
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv_path', default="/home/marcelr/BridgeData")
+    parser.add_argument('--mode', choices=['exact', 'embedding'], default='exact')
+    parser.add_argument('--threshold', type=float, default=0.9, help='cosine similarity of near-duplicate labels')
+    parser.add_argument('--table', help='embedding table of conversion_utils/precompute_embeddings.py, '
+                                        'else the labels are embedded with the sentence encoder')
+    args = parser.parse_args()
+
+    csv_path = args.csv_path
+    episodes = read_labels(csv_path)
+    if args.mode == 'exact':
+        output_dict = exact_mapping(episodes)
+    else:
+        output_dict = embedding_mapping(episodes, args.threshold, args.table)
 
     max_length = 0
     from_label = ""
@@ -32,10 +146,8 @@ if __name__ == "__main__":
     print("max length: ", max_length, " in label: ", from_label)
 
     with open(os.path.join(csv_path, "mapping.csv"), 'w', newline='') as mapping_csv_file:
-        fieldnames = ["bridge_label", "lupus_label_0", "lupus_label_1", "lupus_label_2", "lupus_label_3", "lupus_label_4", "lupus_label_5", "lupus_label_6",
-                      "lupus_label_7", "lupus_label_8", "lupus_label_9", "lupus_label_10", "lupus_label_11", "lupus_label_12", "lupus_label_13", "lupus_label_14",
-                      "lupus_label_15", "lupus_label_16", "lupus_label_17", "lupus_label_18", "lupus_label_19", "lupus_label_20", "lupus_label_21", "lupus_label_22",
-                    ]
+        # one column per lupus label of the longest row, at least the 23 columns of earlier mappings
+        fieldnames = ["bridge_label"] + ["lupus_label_" + str(i) for i in range(max(max_length, 23))]
         mapping_csv_writer = csv.DictWriter(mapping_csv_file, delimiter=';', quoting=csv.QUOTE_MINIMAL, fieldnames=fieldnames)
         mapping_csv_writer.writeheader()
         for bridge_label, lupus_list in output_dict.items():
@@ -44,8 +156,4 @@ if __name__ == "__main__":
             }
             for i in range(len(lupus_list)):
                 row_dict["lupus_label_" + str(i)] = lupus_list[i]
-                if i >= 22:
-                    break
             mapping_csv_writer.writerow(row_dict)
-
-
@@ -0,0 +1,234 @@
+import os
+import re
+import csv
+import json
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Counts the tasks, objects and spatial relations of the lupus and bridge instructions of every episode and writes
+# the counter_data JSON files read by the plot scripts (testing_plots.py, plots_*.py), in one pass over the
+# instructions of lang_lupus.csv / lang_text.csv (see log_txt_as_csv.py) or of a built dataset, e.g.:
+#   python3 extract_lexicon.py --csv_path /home/marcelr/BridgeData --output_path /home/marcelr/rlds_dataset_builder/data
+#   python3 extract_lexicon.py --dataset ~/tensorflow_datasets/bridge/default/1.0.2
+#   python3 -m bridge.extract_lexicon --data_path /home/marcelr/BridgeData/raw
+# Every label is counted once per episode, episodes without spatial relation are counted as 'None'.
+
+# normalized label: surface forms, the longest form matches first
+TASKS = {
+    "pick up": ["pick up", "pick", "grab", "take", "lift", "grasp"],
+    "place": ["put", "place", "set", "drop", "position", "lay"],
+    "move": ["move", "push", "slide", "shift", "relocate", "bring", "transfer"],
+    "open": ["open"],
+    "close": ["close", "shut"],
+    "turn on": ["turn on", "switch on"],
+    "turn off": ["turn off", "switch off"],
+    "rotate": ["turn", "rotate", "twist"],
+    "flip": ["flip", "turn over"],
+    "fold": ["fold"],
+    "unfold": ["unfold", "spread"],
+    "wipe": ["wipe", "clean", "sweep"],
+    "stack": ["stack"],
+    "pour": ["pour"],
+    "remove": ["remove", "take out"],
+    "knock over": ["knock over", "topple"],
+}
+OBJECTS = {
+    "pot": ["pot", "saucepan"],
+    "pan": ["pan", "frying pan", "skillet"],
+    "lid": ["lid"],
+    "spoon": ["spoon", "ladle"],
+    "fork": ["fork"],
+    "knife": ["knife", "knives"],
+    "spatula": ["spatula"],
+    "bowl": ["bowl"],
+    "cup": ["cup", "mug", "glass"],
+    "plate": ["plate", "dish"],
+    "cloth": ["cloth", "towel", "rag", "napkin"],
+    "sponge": ["sponge", "brush"],
+    "carrot": ["carrot"],
+    "corn": ["corn"],
+    "eggplant": ["eggplant", "aubergine"],
+    "banana": ["banana"],
+    "mushroom": ["mushroom"],
+    "pepper": ["pepper"],
+    "potato": ["potato"],
+    "tomato": ["tomato"],
+    "lemon": ["lemon"],
+    "fruit": ["fruit", "apple", "grape", "strawberry", "peach"],
+    "vegetable": ["vegetable", "veggie", "cucumber", "broccoli", "onion"],
+    "can": ["can", "tin"],
+    "bottle": ["bottle"],
+    "block": ["block", "cube", "brick"],
+    "toy": ["toy", "stuffed animal", "doll"],
+    "sink": ["sink", "basin"],
+    "stove": ["stove", "stovetop", "burner", "hob", "cooktop"],
+    "drawer": ["drawer"],
+    "microwave": ["microwave"],
+    "oven": ["oven"],
+    "cabinet": ["cabinet", "cupboard"],
+    "faucet": ["faucet", "tap"],
+    "table": ["table", "counter", "countertop", "surface"],
+    "basket": ["basket"],
+    "colander": ["colander", "strainer"],
+    "knob": ["knob"],
+    "door": ["door"],
+}
+SPATIAL_RELATIONS = {
+    "on": ["on", "onto", "on top of", "atop"],
+    "in": ["in", "into", "inside", "within"],
+    "out of": ["out of", "from"],
+    "next to": ["next to", "beside", "near", "close to", "by"],
+    "left of": ["left of", "to the left of", "on the left of", "on the left side of"],
+    "right of": ["right of", "to the right of", "on the right of", "on the right side of"],
+    "in front of": ["in front of"],
+    "behind": ["behind", "in back of"],
+    "under": ["under", "below", "underneath", "beneath"],
+    "above": ["above", "over"],
+    "between": ["between"],
+}
+
+
+def compile_vocabulary(vocabulary, plurals=False, exclude_after=()):
+    """One regex matching all surface forms of a vocabulary and the dict from form to normalized label."""
+    forms = {form: label for label, label_forms in vocabulary.items() for form in label_forms}
+    alternatives = "|".join(re.escape(form).replace(r"\ ", r"\s+") for form in sorted(forms, key=len, reverse=True))
+    # e.g. the "on" of "turn on" is no spatial relation
+    lookbehinds = "".join(f"(?<!{re.escape(word)} )" for word in exclude_after)
+    pattern = rf"\b{lookbehinds}({alternatives})" + (r"(?:e?s)?\b" if plurals else r"\b")
+    return re.compile(pattern), forms
+
+
+TASK_PATTERN = compile_vocabulary(TASKS)
+OBJECT_PATTERN = compile_vocabulary(OBJECTS, plurals=True)
+SPATIAL_PATTERN = compile_vocabulary(SPATIAL_RELATIONS, exclude_after=("turn", "switch", "pick", "take", "knock"))
+
+
+def match_labels(compiled, text, first_only=False):
+    pattern, forms = compiled
+    labels = []
+    for match in pattern.finditer(text.lower()):
+        labels.append(forms[" ".join(match.group(1).split())])
+        if first_only:
+            break
+    return labels
+
+
+def count_episodes(episodes):
+    """Counters of tasks, objects and spatial relations of a chunk of episodes, given as lists of instructions."""
+    tasks, objects, spatial_relations = Counter(), Counter(), Counter()
+    for instructions in episodes:
+        episode_tasks, episode_objects, episode_relations = set(), set(), set()
+        for instruction in instructions:
+            # the task is the first verb of an instruction
+            episode_tasks.update(match_labels(TASK_PATTERN, instruction, first_only=True))
+            episode_objects.update(match_labels(OBJECT_PATTERN, instruction))
+            episode_relations.update(match_labels(SPATIAL_PATTERN, instruction))
+        tasks.update(episode_tasks)
+        objects.update(episode_objects)
+        spatial_relations.update(episode_relations or ["None"])
+    return tasks, objects, spatial_relations
+
+
+def read_csv_instructions(csv_path):
+    # lupus and bridge instructions of every episode, the columns of log_txt_as_csv.py
+    lupus_episodes, bridge_episodes = [], []
+    with open(os.path.join(csv_path, "lang_lupus.csv"), newline='') as csv_lupus, open(os.path.join(csv_path, "lang_text.csv"), newline='') as csv_text:
+        for row_lupus, row_text in zip(csv.DictReader(csv_lupus, delimiter=';'), csv.DictReader(csv_text, delimiter=';')):
+            lupus_episodes.append([text for key, text in row_lupus.items() if key.startswith("language_instruction") and text])
+            bridge_episodes.append([text for key, text in row_text.items() if key.startswith("language_instruction") and text])
+    return lupus_episodes, bridge_episodes
+
+
+def read_txt_instructions(file_path):
+    # instructions of a lang.txt or lang_lupus.txt, one per line before the confidence line
+    with open(file_path, 'rb') as f:
+        text = f.read().decode("utf-8")
+    return [line for line in text[:text.find("\nconfidence:")].split("\n") if line]
+
+
+def read_raw_instructions(data_path):
+    # lupus and bridge instructions of every raw episode, read independently of each other, so that episodes
+    # with only a lupus annotation or only a lang.txt are counted too
+    from conversion_utils.discovery import find_episodes
+    lupus_episodes, bridge_episodes = [], []
+    for episode_path in find_episodes(data_path, "raw", episode_depth=2):
+        lupus_path = os.path.join(episode_path, "annotations", "lang_lupus.txt")
+        lang_txt_path = os.path.join(episode_path, "lang.txt")
+        if os.path.isfile(lupus_path):
+            lupus_episodes.append(read_txt_instructions(lupus_path))
+        if os.path.isfile(lang_txt_path):
+            bridge_episodes.append(read_txt_instructions(lang_txt_path))
+    return lupus_episodes, bridge_episodes
+
+
+def read_dataset_instructions(builder_dir, split="train"):
+    # language_instruction* (lupus) and groundtruth* (bridge) of the steps or of episode_metadata
+    import tensorflow_datasets as tfds
+    lupus_episodes, bridge_episodes = [], []
+    for episode in tfds.builder_from_directory(builder_dir).as_dataset(split=split):
+        metadata = episode['episode_metadata']
+        if 'language_instructions' in metadata:
+            lupus = metadata['language_instructions'].numpy().tolist()
+            bridge = metadata['groundtruths'].numpy().tolist()
+        else:
+            step = next(iter(episode['steps'].take(1)))
+            lupus = [step[key].numpy() for key in step if key.startswith('language_instruction')]
+            bridge = [step[key].numpy() for key in step if key.startswith('groundtruth')]
+        lupus_episodes.append([text.decode("utf-8") for text in lupus if text])
+        bridge_episodes.append([text.decode("utf-8") for text in bridge if text])
+    return lupus_episodes, bridge_episodes
+
+
+def count_chunk(chunk):
+    lupus_episodes, bridge_episodes = chunk
+    return count_episodes(lupus_episodes), count_episodes(bridge_episodes)
+
+
+def count_parallel(lupus_episodes, bridge_episodes, num_workers, chunk_size=2000):
+    """Counters of the lupus and of the bridge instructions, counted in chunks of episodes by a process pool."""
+    chunks = [(lupus_episodes[start:start + chunk_size], bridge_episodes[start:start + chunk_size])
+              for start in range(0, max(len(lupus_episodes), len(bridge_episodes)), chunk_size)]
+    lupus_counters = Counter(), Counter(), Counter()
+    bridge_counters = Counter(), Counter(), Counter()
+    with ProcessPoolExecutor(num_workers) as pool:
+        for chunk_lupus, chunk_bridge in pool.map(count_chunk, chunks):
+            for counter, chunk_counter in zip(lupus_counters + bridge_counters, chunk_lupus + chunk_bridge):
+                counter.update(chunk_counter)
+    return lupus_counters, bridge_counters
+
+
+def write_counter(counter, file_path):
+    with open(file_path, 'w') as file:
+        json.dump({"counter_data": dict(counter.most_common())}, file, indent=2)
+    print("wrote", len(counter), "labels to", file_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv_path', default="/home/marcelr/BridgeData", help='directory of lang_lupus.csv and lang_text.csv')
+    parser.add_argument('--dataset', help='built dataset directory to read the instructions from instead of the CSVs')
+    parser.add_argument('--data_path', help='raw bridge data to read the instructions from instead of the CSVs, the CSVs '
+                                            'only hold the episodes with both a lupus annotation and a lang.txt')
+    parser.add_argument('--output_path', default="/home/marcelr/rlds_dataset_builder/data")
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.dataset:
+        lupus_episodes, bridge_episodes = read_dataset_instructions(args.dataset)
+    elif args.data_path:
+        lupus_episodes, bridge_episodes = read_raw_instructions(args.data_path)
+    else:
+        lupus_episodes, bridge_episodes = read_csv_instructions(args.csv_path)
+    print(len(lupus_episodes), "lupus episodes,", len(bridge_episodes), "bridge episodes")
+
+    lupus_counters, bridge_counters = count_parallel(lupus_episodes, bridge_episodes, args.num_workers)
+    lupus_tasks, lupus_objects, lupus_relations = lupus_counters
+    bridge_tasks, bridge_objects, bridge_relations = bridge_counters
+    os.makedirs(args.output_path, exist_ok=True)
+    write_counter(lupus_tasks, os.path.join(args.output_path, 'lupus_tasks_clean.json'))
+    write_counter(lupus_objects, os.path.join(args.output_path, 'normalized_lupus_objects.json'))
+    write_counter(lupus_relations, os.path.join(args.output_path, 'normalized_lupus_spatial_relations.json'))
+    write_counter(bridge_tasks, os.path.join(args.output_path, 'bridge_tasks_cleaned.json'))
+    write_counter(bridge_objects, os.path.join(args.output_path, 'grouped_bridge_objects.json'))
+    write_counter(bridge_relations, os.path.join(args.output_path, 'normalized_bridge_spatial_relations.json'))
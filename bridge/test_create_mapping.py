@@ -0,0 +1,43 @@
+import numpy as np
+
+from bridge import create_mapping
+
+# unit embeddings of the test labels, the two pot labels are near-duplicates, the drawer label is unrelated
+EMBEDDINGS = {
+    "put the pot on the burner": [1.0, 0.0, 0.0],
+    "put pot on burner": [0.99, 0.141, 0.0],
+    "open the drawer": [0.0, 0.0, 1.0],
+}
+
+
+def _embed_texts(texts, table_dir=None):
+    embeddings = np.array([EMBEDDINGS[text] for text in texts], dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def test_shared_lupus_label_does_not_join_unrelated_bridge_labels(monkeypatch):
+    monkeypatch.setattr(create_mapping, "embed_texts", _embed_texts)
+    episodes = [
+        ("put the pot on the burner", ["move the pot to the stove", "do the task"]),
+        ("open the drawer", ["pull the drawer open", "do the task"]),
+    ]
+    mapping = create_mapping.embedding_mapping(episodes, threshold=0.9)
+    assert mapping == {
+        "put the pot on the burner": ["move the pot to the stove", "do the task"],
+        "open the drawer": ["pull the drawer open", "do the task"],
+    }
+
+
+def test_near_duplicate_bridge_labels_share_a_cluster(monkeypatch):
+    monkeypatch.setattr(create_mapping, "embed_texts", _embed_texts)
+    episodes = [
+        ("put the pot on the burner", ["move the pot to the stove"]),
+        ("put the pot on the burner", ["move the pot to the stove"]),
+        ("put pot on burner", ["place the pot on the burner"]),
+        ("open the drawer", ["pull the drawer open"]),
+    ]
+    mapping = create_mapping.embedding_mapping(episodes, threshold=0.9, block_size=2)
+    assert mapping == {
+        "put the pot on the burner": ["move the pot to the stove", "place the pot on the burner", "put pot on burner"],
+        "open the drawer": ["pull the drawer open"],
+    }
@@ -0,0 +1,210 @@
+import argparse
+import glob
+import importlib
+import json
+import os
+
+from conversion_utils import settings
+from conversion_utils.embedding_server import embedding_server_model
+from conversion_utils.parallel import parse_episodes
+
+# Appends newly recorded episodes to a built dataset as additional shards, without rebuilding it, e.g.:
+#   python3 -m conversion_utils.append_episodes kit_irl_real_kitchen_vis.kit_irl_real_kitchen_vis \
+#       ~/tensorflow_datasets/kit_irl_real_kitchen_vis/1.0.0 --data_path <raw data path>
+# The episodes of get_episode_paths(data_path) of the builder module that are not in the dataset yet are parsed with
+# its _parse_example, or get_parse_fn(<config of the dataset>) for builders with configs, and written to new shards.
+# The existing shards are only renamed for their new -of-<N> suffix, dataset_info.json gets the new shard lengths
+# and split size. The episode paths already in the dataset are kept in ingested_episodes.json next to the shards,
+# the first append reads them from episode_metadata/file_path. The renames and the new dataset_info.json are recorded
+# in append_journal.json before the first rename, a rerun completes an interrupted append first.
+
+INGESTED_FILE = "ingested_episodes.json"
+# renames and dataset_info.json of an append that is not complete yet
+JOURNAL_FILE = "append_journal.json"
+# largest shard written, the default maximum shard size of tfds
+MAX_SHARD_BYTES = 1024 << 20
+
+
+def _shard_path(dataset_dir, info, split, index, num_shards):
+    # the default filepathTemplate of tfds: {DATASET}-{SPLIT}.{FILEFORMAT}-{SHARD_X_OF_Y}
+    file_name = f"{info['name']}-{split}.{info.get('fileFormat', 'tfrecord')}-{index:05d}-of-{num_shards:05d}"
+    return os.path.join(dataset_dir, file_name)
+
+
+def _split_info(info, split):
+    for split_info in info["splits"]:
+        if split_info["name"] == split:
+            template = split_info.get("filepathTemplate", "{DATASET}-{SPLIT}.{FILEFORMAT}-{SHARD_X_OF_Y}")
+            if template != "{DATASET}-{SPLIT}.{FILEFORMAT}-{SHARD_X_OF_Y}":
+                raise ValueError(f"unsupported shard file template {template}")
+            return split_info
+    raise ValueError(f"dataset has no split {split}")
+
+
+def _write_json(data, file_path):
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, file_path)
+
+
+def read_ingested(dataset_dir, info, split):
+    """Episode paths already in a split, from ingested_episodes.json or the episode_metadata/file_path of its shards."""
+    ingested_path = os.path.join(dataset_dir, INGESTED_FILE)
+    if os.path.isfile(ingested_path):
+        with open(ingested_path) as f:
+            return json.load(f).get(split, [])
+    import tensorflow as tf
+    num_shards = len(_split_info(info, split)["shardLengths"])
+    shard_paths = [_shard_path(dataset_dir, info, split, index, num_shards) for index in range(num_shards)]
+    # only the file path is parsed, the steps stay serialized
+    spec = {"episode_metadata/file_path": tf.io.FixedLenFeature([], tf.string)}
+    return [tf.io.parse_single_example(record, spec)["episode_metadata/file_path"].numpy().decode("utf-8")
+            for record in tf.data.TFRecordDataset(shard_paths)]
+
+
+def write_shards(examples, features, tmp_prefix, max_shard_bytes=MAX_SHARD_BYTES):
+    """Serializes the (key, example) tuples into shards of at most max_shard_bytes.
+
+    Returns the temporary shard paths, the number of examples of every shard, the bytes written and the keys.
+    """
+    import tensorflow as tf
+    from tensorflow_datasets.core import example_serializer
+    serializer = example_serializer.ExampleSerializer(features.get_serialized_info())
+    shard_paths, shard_lengths, keys = [], [], []
+    num_bytes = 0
+    writer, shard_bytes = None, 0
+    for key, example in examples:
+        record = serializer.serialize_example(features.encode_example(example))
+        if writer is not None and shard_bytes + len(record) > max_shard_bytes:
+            writer.close()
+            writer = None
+        if writer is None:
+            shard_paths.append(f"{tmp_prefix}-{len(shard_paths):05d}")
+            shard_lengths.append(0)
+            writer, shard_bytes = tf.io.TFRecordWriter(shard_paths[-1]), 0
+        writer.write(record)
+        shard_lengths[-1] += 1
+        shard_bytes += len(record)
+        num_bytes += len(record)
+        keys.append(key)
+    if writer is not None:
+        writer.close()
+    return shard_paths, shard_lengths, num_bytes, keys
+
+
+def _roll_forward(dataset_dir):
+    # completes an append whose journal was written, the renames already done are skipped
+    journal_path = os.path.join(dataset_dir, JOURNAL_FILE)
+    if not os.path.isfile(journal_path):
+        return
+    with open(journal_path) as f:
+        journal = json.load(f)
+    for src, dst in journal["renames"]:
+        src, dst = os.path.join(dataset_dir, src), os.path.join(dataset_dir, dst)
+        if os.path.exists(src):
+            os.rename(src, dst)
+        elif not os.path.exists(dst):
+            raise FileNotFoundError(f"{src} of the interrupted append is missing")
+    info_tmp_path = os.path.join(dataset_dir, journal["info"])
+    if os.path.exists(info_tmp_path):
+        os.replace(info_tmp_path, os.path.join(dataset_dir, "dataset_info.json"))
+    _write_json(journal["ingested"], os.path.join(dataset_dir, INGESTED_FILE))
+    os.remove(journal_path)
+    print(f"completed the append of {journal_path}")
+
+
+def _remove_tmp_shards(tmp_prefix):
+    for tmp_path in glob.glob(glob.escape(tmp_prefix) + "-*"):
+        os.remove(tmp_path)
+
+
+def append_episodes(module, dataset_dir, data_path, split="train", max_shard_bytes=MAX_SHARD_BYTES):
+    """Parses the episodes of data_path that are not in the dataset yet and appends them to split as new shards.
+
+    The new shards are written to temporary files first. The renames of all shards and the new dataset_info.json
+    are then recorded in a journal before any of them is done, so a rerun after an interruption completes them.
+    """
+    import tensorflow_datasets as tfds
+    _roll_forward(dataset_dir)
+    info_path = os.path.join(dataset_dir, "dataset_info.json")
+    with open(info_path) as f:
+        info = json.load(f)
+    split_info = _split_info(info, split)
+    tmp_prefix = os.path.join(dataset_dir, f"{info['name']}-{split}.append-tmp")
+    # shards of a run that was interrupted before it wrote its journal
+    _remove_tmp_shards(tmp_prefix)
+    ingested = read_ingested(dataset_dir, info, split)
+    ingested_set = set(ingested)
+    episode_paths = [path for path in module.get_episode_paths(data_path) if path not in ingested_set]
+    print(f"{len(ingested)} episodes in the dataset, {len(episode_paths)} new episodes")
+    if not episode_paths:
+        return
+
+    parse_fn = module._parse_example
+    if hasattr(module, "get_parse_fn"):
+        # examples of the builder config the dataset was built with
+        parse_fn = module.get_parse_fn(info.get("configName") or "default")
+    embed_loader = getattr(module, "load_embed", None)
+    journal_written = False
+    try:
+        examples = parse_episodes(episode_paths, parse_fn,
+                                  embed=embed_loader() if embed_loader is not None and settings.NUM_WORKERS <= 0 else None,
+                                  embed_loader=embed_loader, num_workers=settings.NUM_WORKERS, ordered=settings.ORDERED,
+                                  shared_memory=settings.SHARED_MEMORY, num_cpus=settings.NUM_CPUS,
+                                  embedding_server=embedding_server_model(),
+                                  embedding_server_threads=settings.EMBEDDING_SERVER_THREADS)
+        features = tfds.builder_from_directory(dataset_dir).info.features
+        tmp_paths, new_lengths, num_bytes, keys = write_shards(examples, features, tmp_prefix, max_shard_bytes)
+        print(f"parsed {len(keys)} episodes, {len(episode_paths) - len(keys)} skipped")
+        if not keys:
+            return
+
+        # the shard file names end in -of-<number of shards>, the existing shards are renamed, not rewritten
+        old_lengths = split_info["shardLengths"]
+        num_shards = len(old_lengths) + len(new_lengths)
+        renames = [(_shard_path(dataset_dir, info, split, index, len(old_lengths)),
+                    _shard_path(dataset_dir, info, split, index, num_shards)) for index in range(len(old_lengths))]
+        renames += [(tmp_path, _shard_path(dataset_dir, info, split, len(old_lengths) + index, num_shards))
+                    for index, tmp_path in enumerate(tmp_paths)]
+
+        # tfds stores the int64 fields of dataset_info.json as strings
+        split_info["shardLengths"] = old_lengths + [str(length) for length in new_lengths]
+        split_info["numBytes"] = str(int(split_info.get("numBytes", 0)) + num_bytes)
+        if "numExamples" in split_info.get("statistics", {}):
+            split_info["statistics"]["numExamples"] = str(int(split_info["statistics"]["numExamples"]) + len(keys))
+        info_tmp_path = info_path + ".append-tmp"
+        _write_json(info, info_tmp_path)
+
+        ingested_path = os.path.join(dataset_dir, INGESTED_FILE)
+        ingested_splits = {}
+        if os.path.isfile(ingested_path):
+            with open(ingested_path) as f:
+                ingested_splits = json.load(f)
+        ingested_splits[split] = ingested + keys
+        # from here on, the append is completed by _roll_forward, also by a rerun if it is interrupted
+        _write_json({"renames": [(os.path.basename(src), os.path.basename(dst)) for src, dst in renames],
+                     "info": os.path.basename(info_tmp_path), "ingested": ingested_splits},
+                    os.path.join(dataset_dir, JOURNAL_FILE))
+        journal_written = True
+    finally:
+        if not journal_written:
+            _remove_tmp_shards(tmp_prefix)
+    _roll_forward(dataset_dir)
+    print(f"appended {len(keys)} episodes ({num_bytes / 2**20:.1f} MiB) as {len(new_lengths)} shards to {dataset_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('builder', help='builder module with get_episode_paths(path) and _parse_example(episode_path, embed)')
+    parser.add_argument('dataset_dir', help='built dataset directory, e.g. ~/tensorflow_datasets/<name>/<version>')
+    parser.add_argument('--data_path', help='raw data path of the builder, defaults to the data_path of the module')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--max_shard_mb', type=int, default=MAX_SHARD_BYTES >> 20)
+    args = parser.parse_args()
+
+    builder_module = importlib.import_module(args.builder)
+    data_path = args.data_path or getattr(builder_module, "data_path", None)
+    if data_path is None:
+        parser.error(f"{args.builder} has no module level data_path, pass --data_path")
+    append_episodes(builder_module, os.path.expanduser(args.dataset_dir), data_path, args.split, args.max_shard_mb << 20)
@@ -0,0 +1,32 @@
+import apache_beam as beam
+
+from conversion_utils.embedding import print_embedding_stats
+
+
+class ParseExampleFn(beam.DoFn):
+    """Beam version of parallel.parse_episodes, every worker creates its embed once in setup()."""
+
+    def __init__(self, parse_fn, embed_loader=None):
+        self._parse_fn = parse_fn
+        self._embed_loader = embed_loader
+        self._embed = None
+
+    def setup(self):
+        if self._embed_loader is not None:
+            self._embed = self._embed_loader()
+
+    def teardown(self):
+        if hasattr(self._embed, "stats"):
+            print_embedding_stats([self._embed.stats()])
+
+    def process(self, episode_path):
+        example = self._parse_fn(episode_path, self._embed)
+        if example is not None:
+            yield example
+
+
+def parse_episodes_beam(episode_paths, parse_fn, embed_loader=None):
+    return (
+            beam.Create(episode_paths)
+            | beam.ParDo(ParseExampleFn(parse_fn, embed_loader))
+    )
@@ -0,0 +1,47 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from conversion_utils.images import load_frames
+
+# Measures the episode decode time of load_frames with a growing number of decode threads on synthetic
+# 480x640 JPEG frames. Speedups are relative to the first thread count, run from the repo root with:
+# python3 -m conversion_utils.benchmark_decode --cameras 5 --frames 40
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--cameras', type=int, default=5, help='number of cameras per episode')
+parser.add_argument('--frames', type=int, default=40, help='number of frames per camera')
+parser.add_argument('--threads', type=int, nargs='+', default=[0, 2, 4, 8, 16], help='decode thread counts to test')
+parser.add_argument('--repeats', type=int, default=3, help='number of timed runs per thread count')
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    rng = np.random.default_rng(0)
+    # smooth noise compresses like a camera frame, pure noise would make the jpeg decode unrealistically slow
+    base = cv2.resize(rng.integers(0, 256, (60, 80, 3), dtype=np.uint8), (640, 480))
+    frame_paths = {}
+    for cam in range(args.cameras):
+        cam_dir = os.path.join(tmp_dir, f"images{cam}")
+        os.makedirs(cam_dir)
+        frame_paths[cam] = []
+        for i in range(args.frames):
+            img_path = os.path.join(cam_dir, f"im_{i}.jpg")
+            cv2.imwrite(img_path, np.roll(base, i, axis=1))
+            frame_paths[cam].append(img_path)
+
+    print(f"{args.cameras} cameras x {args.frames} frames, {os.cpu_count()} cpus")
+    if os.cpu_count() == 1:
+        print("single cpu: decode threads can not speed up decoding here, run on a multi-core machine")
+    baseline_time = None
+    for num_threads in args.threads:
+        load_frames(frame_paths, num_threads)  # warm up the page cache and the decode pool
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            load_frames(frame_paths, num_threads)
+        episode_time = (time.perf_counter() - start) / args.repeats
+        baseline_time = baseline_time or episode_time
+        print(f"threads: {num_threads:3d}  episode decode: {episode_time * 1000:8.1f} ms  speedup: {baseline_time / episode_time:5.2f}x")
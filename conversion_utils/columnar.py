@@ -0,0 +1,128 @@
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+# sidecar directory of a pickle, e.g. policy_out.pkl.columns next to policy_out.pkl
+COLUMNS_SUFFIX = ".columns"
+# dtype kinds stored as memory mapped .npy files, strings and objects are pickled with the rest
+_ARRAY_KINDS = "biufc"
+
+
+class Records:
+    """List of dicts stored column by column, records[i] is the dict of row i."""
+
+    def __init__(self, columns, length):
+        self.columns = columns
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        return {key: column[index] for key, column in self.columns.items()}
+
+    def __iter__(self):
+        return (self[index] for index in range(self._length))
+
+
+def is_sidecar(name):
+    # also the temporary directory of a sidecar that is being written
+    return COLUMNS_SUFFIX in name
+
+
+def _load_source(pickle_path):
+    data = np.load(pickle_path, allow_pickle=True)
+    # np.load wraps some pickled objects in a 0-d object array
+    if isinstance(data, np.ndarray) and data.dtype == object and data.ndim == 0:
+        data = data.item()
+    return data
+
+
+def _split_columns(mapping):
+    # (arrays, rest): the values that are regular numeric arrays and everything else, scalars like traj_length
+    # are kept with the rest since memory maps have at least one dimension
+    arrays, rest = {}, {}
+    for key, value in mapping.items():
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            # ragged sequences
+            array = None
+        if array is not None and array.ndim > 0 and array.dtype.kind in _ARRAY_KINDS:
+            arrays[key] = array
+        else:
+            rest[key] = value
+    return arrays, rest
+
+
+def write_columns(pickle_path):
+    """Writes the sidecar of a pickled dict of arrays or list of dicts, one .npy file per key.
+
+    Returns False if the pickle holds anything else. The sidecar records the size and mtime of the pickle and is
+    ignored once the pickle changes.
+    """
+    data = _load_source(pickle_path)
+    if isinstance(data, dict):
+        kind, length = "dict", None
+        arrays, rest = _split_columns(data)
+    elif isinstance(data, (list, tuple)) and data and all(isinstance(row, dict) and row.keys() == data[0].keys() for row in data):
+        kind, length = "records", len(data)
+        arrays, rest = _split_columns({key: [row[key] for row in data] for key in data[0]})
+    else:
+        return False
+
+    stat = os.stat(pickle_path)
+    columns_dir = pickle_path + COLUMNS_SUFFIX
+    # written to a temporary directory first, so that readers never see a partial sidecar
+    tmp_dir = columns_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    keys = list(arrays)
+    for index, key in enumerate(keys):
+        np.save(os.path.join(tmp_dir, f"{index}.npy"), np.ascontiguousarray(arrays[key]))
+    if rest:
+        with open(os.path.join(tmp_dir, "rest.pkl"), "wb") as f:
+            pickle.dump(rest, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+        json.dump({"kind": kind, "length": length, "keys": keys, "rest": bool(rest),
+                   "source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}, f)
+    shutil.rmtree(columns_dir, ignore_errors=True)
+    os.replace(tmp_dir, columns_dir)
+    return True
+
+
+def _read_columns(pickle_path):
+    # the memory mapped sidecar of a pickle, None if there is none or the pickle changed since it was written
+    columns_dir = pickle_path + COLUMNS_SUFFIX
+    try:
+        with open(os.path.join(columns_dir, "index.json")) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if os.path.exists(pickle_path):
+        stat = os.stat(pickle_path)
+        if (stat.st_size, stat.st_mtime_ns) != (index["source_size"], index["source_mtime_ns"]):
+            return None
+    columns = {}
+    for position, key in enumerate(index["keys"]):
+        columns[key] = np.load(os.path.join(columns_dir, f"{position}.npy"), mmap_mode='r')
+    if index["rest"]:
+        with open(os.path.join(columns_dir, "rest.pkl"), "rb") as f:
+            columns.update(pickle.load(f))
+    if index["kind"] == "records":
+        return Records(columns, index["length"])
+    return columns
+
+
+def load_pickle(pickle_path):
+    """np.load(pickle_path, allow_pickle=True), from the memory mapped sidecar of the pickle if there is one.
+
+    Dicts are returned as dicts of arrays, lists of dicts as Records.
+    """
+    data = _read_columns(pickle_path)
+    if data is None:
+        data = np.load(pickle_path, allow_pickle=True)
+    return data
@@ -0,0 +1,48 @@
+import argparse
+import glob
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from conversion_utils.columnar import write_columns
+
+# Converts the pickled robot data of all episodes of a builder into columnar sidecars, one memory mapped .npy file
+# per key (e.g. policy_out.pkl.columns next to policy_out.pkl). The builders read the sidecars instead of unpickling
+# when they are present, e.g.:
+#   python3 -m conversion_utils.convert_pickles bridge.bridge_dataset_builder --data_path /home/marcelr/BridgeData/raw
+#   python3 -m conversion_utils.convert_pickles kit_irl_real_kitchen_lang.kit_irl_real_kitchen_lang
+# Sidecars of pickles that changed since are ignored, run the conversion again to update them.
+
+PATTERNS = ("*.pkl", "*.pickle")
+
+
+def convert_episode(episode_path):
+    # (converted, skipped) pickles of an episode
+    converted, skipped = 0, 0
+    for pattern in PATTERNS:
+        for pickle_path in glob.glob(os.path.join(episode_path, pattern)):
+            if write_columns(pickle_path):
+                converted += 1
+            else:
+                skipped += 1
+    return converted, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('builder', help='builder module that defines get_episode_paths(path)')
+    parser.add_argument('--data_path', help='raw data path of the builder, defaults to the data_path of the module')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.builder)
+    data_path = args.data_path or getattr(module, "data_path", None)
+    if data_path is None:
+        parser.error(f"{args.builder} has no module level data_path, pass --data_path")
+    episode_paths = module.get_episode_paths(data_path)
+    num_converted, num_skipped = 0, 0
+    with ProcessPoolExecutor(args.num_workers) as pool:
+        for converted, skipped in pool.map(convert_episode, episode_paths, chunksize=16):
+            num_converted += converted
+            num_skipped += skipped
+    print(f"converted {num_converted} pickles of {len(episode_paths)} episodes, {num_skipped} are not columnar")
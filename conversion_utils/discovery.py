@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from conversion_utils.columnar import is_sidecar
+from conversion_utils.frame_pack import IMAGE_EXTENSIONS, is_pack
+
+MANIFEST_VERSION = 2
+
+
+def is_derived(name):
+    """True for the files the conversion tools write next to the raw data: frame packs and pickle sidecars."""
+    return is_pack(name) or is_sidecar(name)
+
+
+def _scan_dir(path, cached_node):
+    # one stat per directory, the directory is only listed again if its mtime changed since the last build
+    mtime_ns = os.stat(path).st_mtime_ns
+    if cached_node is not None and cached_node["mtime_ns"] == mtime_ns:
+        return cached_node
+    with os.scandir(path) as entries:
+        # is_dir() uses the file type of the directory entry and does not stat every file
+        subdirs = sorted(entry.name for entry in entries if entry.is_dir())
+    return {"mtime_ns": mtime_ns, "subdirs": subdirs}
+
+
+def _manifest_path(root, marker, match_parent, episode_depth, manifest_dir):
+    key = json.dumps([os.path.abspath(root), marker, match_parent, episode_depth])
+    return os.path.join(manifest_dir, "episodes_" + hashlib.sha1(key.encode()).hexdigest()[:16] + ".json")
+
+
+def _load_manifest(manifest_path):
+    if manifest_path is None or not os.path.isfile(manifest_path):
+        return {}
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest["dirs"] if manifest.get("version") == MANIFEST_VERSION else {}
+
+
+def _write_manifest(manifest_path, root, dirs, episodes):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "root": root, "episodes": episodes, "dirs": dirs}, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def find_episodes(root, marker, match_parent=False, episode_depth=0, manifest_dir=None, num_threads=16):
+    """Returns the sorted paths of all episode directories below root.
+
+    If match_parent is True, every directory containing a subdirectory named marker is an episode (e.g. "cam_1"),
+    otherwise the directories episode_depth levels below a directory named marker are (e.g. raw/<group>/<traj>).
+    The tree is walked level by level with os.scandir in num_threads threads. If manifest_dir is given,
+    the directory listings are stored in a manifest there together with the directory mtimes, later calls
+    only list the directories whose mtime changed.
+    """
+    manifest_path = _manifest_path(root, marker, match_parent, episode_depth, manifest_dir) if manifest_dir else None
+    cached_dirs = _load_manifest(manifest_path)
+    dirs = {}
+    episodes = []
+    # directories to scan, with their depth below the last marker directory or None above it
+    level = [(root, None)]
+    with ThreadPoolExecutor(num_threads, thread_name_prefix="discovery") as pool:
+        while level:
+            nodes = pool.map(lambda item: _scan_dir(item[0], cached_dirs.get(item[0])), level)
+            next_level = []
+            for (path, depth), node in zip(level, nodes):
+                dirs[path] = node
+                if match_parent and marker in node["subdirs"]:
+                    episodes.append(path)
+                    continue
+                for name in node["subdirs"]:
+                    child = os.path.join(path, name)
+                    if depth is None and not match_parent and name == marker:
+                        child_depth = 0
+                    else:
+                        child_depth = None if depth is None else depth + 1
+                    if child_depth == episode_depth:
+                        episodes.append(child)
+                    else:
+                        next_level.append((child, child_depth))
+            level = next_level
+
+    episodes.sort()
+    if manifest_path is not None:
+        _write_manifest(manifest_path, root, dirs, episodes)
+    return episodes
+
+
+def _dir_cost(path, mtimes):
+    # bytes to read below path, records the mtime of every directory in mtimes
+    mtimes[path] = os.stat(path).st_mtime_ns
+    cost = 0
+    frame_files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if is_derived(entry.name):
+                continue
+            if entry.is_dir():
+                cost += _dir_cost(entry.path, mtimes)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                frame_files.append(entry)
+            elif entry.is_file():
+                cost += entry.stat().st_size
+    if frame_files:
+        # camera folders: number of frames times the median size of a few frames, without a stat per frame
+        frame_files.sort(key=lambda entry: entry.name)
+        samples = {frame_files[0].path, frame_files[len(frame_files) // 2].path, frame_files[-1].path}
+        cost += len(frame_files) * int(np.median([os.stat(sample).st_size for sample in samples]))
+    return cost
+
+
+def _estimate_cost(episode_path, cached_entry):
+    # the cached estimate is reused if no directory of the episode changed, e.g. by frames added to a camera folder
+    if cached_entry is not None:
+        try:
+            if all(os.stat(path).st_mtime_ns == mtime_ns for path, mtime_ns in cached_entry["mtimes"].items()):
+                return cached_entry
+        except (OSError, KeyError):
+            pass
+    mtimes = {}
+    cost = _dir_cost(episode_path, mtimes)
+    return {"mtimes": mtimes, "cost": cost}
+
+
+def estimate_episode_costs(episode_paths, manifest_dir=None, num_threads=16):
+    """Estimates the parse cost of every episode as the number of bytes it has to read.
+
+    Frames are counted per camera folder and multiplied by the median size of its first, middle and last frame,
+    other files are counted with their size, so episodes with more cameras, more frames or larger files cost more.
+    Files written by the conversion tools (frame packs, pickle sidecars) are not counted.
+    If manifest_dir is given, the estimates are cached there for episodes none of whose directories changed.
+    """
+    manifest_path = None
+    cached_costs = {}
+    if manifest_dir and episode_paths:
+        root = os.path.commonpath(episode_paths)
+        manifest_path = _manifest_path(root, "costs", False, 0, manifest_dir)
+        cached_costs = _load_manifest(manifest_path)
+    with ThreadPoolExecutor(num_threads, thread_name_prefix="discovery") as pool:
+        entries = list(pool.map(lambda path: _estimate_cost(path, cached_costs.get(path)), episode_paths))
+    costs = dict(zip(episode_paths, entries))
+    if manifest_path is not None:
+        _write_manifest(manifest_path, root, costs, episode_paths)
+    return {path: entry["cost"] for path, entry in costs.items()}
@@ -0,0 +1,155 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from conversion_utils import settings
+
+
+class LazyEncoder:
+    """Sentence encoder that is loaded from model_path (tfhub url or local SavedModel) on its first call."""
+
+    def __init__(self, model_path):
+        self._model_path = model_path
+        self._model = None
+
+    def __call__(self, texts):
+        if self._model is None:
+            import tensorflow_hub as hub
+            print("loading sentence encoder from", self._model_path)
+            self._model = hub.load(self._model_path)
+        return self._model(texts)
+
+
+class EmbeddingCache:
+    """Wraps a sentence encoder and embeds every distinct text only once.
+
+    The embeddings of the last max_size distinct texts are kept, so instructions that repeat across
+    episodes are not encoded again. Calls take a list of texts (str or utf-8 bytes) and return a
+    (len(texts), dim) float32 array, like encoder(texts).numpy(). Empty texts are embedded as zeros
+    without calling the encoder.
+    """
+
+    def __init__(self, encoder, max_size=4096, dim=512):
+        self._encoder = encoder
+        self._max_size = max_size
+        self._zeros = np.zeros(dim, dtype=np.float32)
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, texts):
+        texts = [text.decode("utf-8") if isinstance(text, bytes) else str(text) for text in texts]
+        embeddings = {"": self._zeros}
+        for text in texts:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                embeddings[text] = self._cache[text]
+        missing = [text for text in dict.fromkeys(texts) if text not in embeddings]
+        self.hits += sum(1 for text in texts if text) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            # one encoder call for all new texts
+            encoded = self._encoder(missing)
+            encoded = np.asarray(encoded.numpy() if hasattr(encoded, "numpy") else encoded, dtype=np.float32)
+            for text, embedding in zip(missing, encoded):
+                embeddings[text] = self._cache[text] = embedding
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+        return np.stack([embeddings[text] for text in texts])
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def print_embedding_stats(stats):
+    """Prints the summed hit rate of EmbeddingCache.stats() dicts, e.g. of all workers.
+
+    EmbeddingTable.stats() dicts also count the texts that were missing from the table.
+    """
+    stats = list(stats)
+    hits = sum(worker_stats["hits"] for worker_stats in stats)
+    misses = sum(worker_stats["misses"] for worker_stats in stats)
+    missing = sum(worker_stats.get("missing", 0) for worker_stats in stats)
+    if hits + misses:
+        print(f"language embeddings: {hits} cache hits, {misses} texts encoded, hit rate {hits / (hits + misses):.1%}")
+    if missing:
+        print(f"language embeddings: {missing} texts were missing from the embedding table, precompute it again")
+
+
+class EmbeddingTable:
+    """Looks up precomputed embeddings in a table written by write_embedding_table.
+
+    The table is memory mapped, so workers share its pages and no encoder is loaded. Calls work like
+    EmbeddingCache calls. Texts missing from the table are embedded with fallback (e.g. an EmbeddingCache of a
+    LazyEncoder, so the encoder is only loaded if a text is missing), without fallback they raise a KeyError.
+    """
+
+    def __init__(self, table_dir, fallback=None):
+        self._table_dir = table_dir
+        self._fallback = fallback
+        self._embeddings = np.load(os.path.join(table_dir, "embeddings.npy"), mmap_mode="r")
+        with open(os.path.join(table_dir, "index.json")) as f:
+            self._index = json.load(f)
+        self.missing = 0
+
+    def __call__(self, texts):
+        texts = [text.decode("utf-8") if isinstance(text, bytes) else str(text) for text in texts]
+        missing = [text for text in texts if text and text not in self._index]
+        if missing and self._fallback is None:
+            raise KeyError(f"{missing} not in the embedding table {self._table_dir}, precompute it again")
+        # empty texts are embedded as zeros, like in EmbeddingCache
+        embeddings = np.zeros((len(texts), self._embeddings.shape[1]), dtype=np.float32)
+        for i, text in enumerate(texts):
+            if text in self._index:
+                embeddings[i] = self._embeddings[self._index[text]]
+        if missing:
+            self.missing += len(missing)
+            rows = [i for i, text in enumerate(texts) if text and text not in self._index]
+            embeddings[rows] = np.asarray(self._fallback(missing), dtype=np.float32)
+        return embeddings
+
+    def stats(self):
+        # the hits and misses of an EmbeddingCache fallback are the missing texts it embedded
+        stats = self._fallback.stats() if hasattr(self._fallback, "stats") else {"hits": 0, "misses": 0}
+        return {**stats, "missing": self.missing}
+
+
+def load_embed(encoder=None):
+    """Embeds the language instructions of a build, with the embedding settings of conversion_utils/settings.py.
+
+    Every distinct instruction is embedded once, instructions repeat across many episodes. The encoder is only
+    loaded when the first non-empty instruction is embedded, or is the RemoteEncoder of the embedding server of
+    the workers. With RLDS_EMBEDDING_TABLE the embeddings precomputed with conversion_utils/precompute_embeddings.py
+    are looked up instead, instructions missing from the table are embedded with the encoder.
+    """
+    cache = EmbeddingCache(encoder or LazyEncoder(settings.EMBEDDING_MODEL), settings.EMBEDDING_CACHE_SIZE)
+    if settings.EMBEDDING_TABLE:
+        return EmbeddingTable(settings.EMBEDDING_TABLE, fallback=cache)
+    return cache
+
+
+def write_embedding_table(texts, encoder, table_dir, batch_size=1024):
+    """Embeds the distinct non-empty texts in batches of batch_size and writes them to table_dir.
+
+    embeddings.npy holds one float32 row per text, index.json maps every text to its row.
+    """
+    texts = [text.decode("utf-8") if isinstance(text, bytes) else str(text) for text in texts]
+    texts = list(dict.fromkeys(text for text in texts if text))
+    os.makedirs(table_dir, exist_ok=True)
+    table = None
+    for start in range(0, len(texts), batch_size):
+        batch = np.asarray(encoder(texts[start:start + batch_size]), dtype=np.float32)
+        if table is None:
+            table = np.lib.format.open_memmap(os.path.join(table_dir, "embeddings.npy"), mode="w+",
+                                              dtype=np.float32, shape=(len(texts), batch.shape[1]))
+        table[start:start + len(batch)] = batch
+        print(f"embedded {start + len(batch)} of {len(texts)} texts")
+    if table is None:
+        np.save(os.path.join(table_dir, "embeddings.npy"), np.zeros((0, 512), dtype=np.float32))
+    else:
+        table.flush()
+    # the index is written last, a table without index is incomplete
+    with open(os.path.join(table_dir, "index.json"), "w") as f:
+        json.dump({text: row for row, text in enumerate(texts)}, f)
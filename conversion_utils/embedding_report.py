@@ -0,0 +1,32 @@
+import argparse
+import os
+
+import numpy as np
+
+from conversion_utils.embedding_storage import EMBEDDING_DTYPES, dequantize_embedding, quantize_embedding
+
+# Reports the storage size and the cosine similarity error of the language embedding storage dtypes, for the
+# embeddings of a table written by conversion_utils/precompute_embeddings.py or random unit vectors, e.g.:
+#   python3 -m conversion_utils.embedding_report --table <table_dir>
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--table', help='embedding table directory, random unit vectors if not given')
+parser.add_argument('--num_random', type=int, default=10000)
+parser.add_argument('--dim', type=int, default=512)
+args = parser.parse_args()
+
+if args.table:
+    embeddings = np.load(os.path.join(args.table, "embeddings.npy"))
+else:
+    embeddings = np.random.default_rng(0).standard_normal((args.num_random, args.dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+print(f"{len(embeddings)} embeddings of size {embeddings.shape[1]}")
+
+for dtype in EMBEDDING_DTYPES:
+    fields = quantize_embedding("embedding", embeddings, dtype)
+    num_bytes = sum(field.nbytes for field in fields.values()) / len(embeddings)
+    restored = dequantize_embedding(fields["embedding"], fields.get("embedding_scale"))
+    cosine = (embeddings * restored).sum(axis=1) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(restored, axis=1))
+    print(f"{dtype:>8}: {num_bytes:7.0f} bytes per vector ({num_bytes / embeddings[0].nbytes:6.1%}), "
+          f"cosine similarity mean {cosine.mean():.6f}, min {cosine.min():.6f}")
@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from conversion_utils import settings
+from conversion_utils.embedding import LazyEncoder
+from conversion_utils.threads import configure_threads
+
+
+class RemoteEncoder:
+    """Sentence encoder that sends its texts to an EmbeddingServer.
+
+    It is picklable, so that it can be handed to worker processes, and connects on its first call.
+    """
+
+    def __init__(self, address, authkey):
+        self._address = address
+        self._authkey = authkey
+        self._conn = None
+
+    def __getstate__(self):
+        return {"_address": self._address, "_authkey": self._authkey, "_conn": None}
+
+    def __call__(self, texts):
+        if self._conn is None:
+            self._conn = Client(self._address, authkey=self._authkey)
+        self._conn.send(list(texts))
+        embeddings = self._conn.recv()
+        if isinstance(embeddings, Exception):
+            raise embeddings
+        return embeddings
+
+
+class EmbeddingServer:
+    """Holds one sentence encoder in its own process and serves all workers on localhost.
+
+    Requests that arrive within batch_window seconds are coalesced into one encoder call of up to
+    max_batch_size texts. The encoder is loaded from model_path on the first request. The server
+    stops with close() and, as a daemon process, with the process that started it.
+    """
+
+    def __init__(self, model_path, num_threads=0, max_batch_size=256, batch_window=0.005):
+        self._authkey = os.urandom(16)
+        ctx = multiprocessing.get_context("spawn")
+        self._control, child_control = ctx.Pipe()
+        self._process = ctx.Process(target=_serve, daemon=True,
+                                    args=(model_path, self._authkey, child_control, num_threads, max_batch_size, batch_window))
+        self._process.start()
+        child_control.close()
+        self.address = self._control.recv()
+
+    def encoder(self):
+        return RemoteEncoder(self.address, self._authkey)
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._control.send(None)
+        except OSError:
+            pass
+        self._process.join(timeout=10)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._control.close()
+        self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _receive(conn, requests):
+    # one thread per worker connection, until the worker closes it
+    try:
+        while True:
+            requests.put((conn, conn.recv()))
+    except (EOFError, OSError):
+        conn.close()
+
+
+def _accept(listener, requests):
+    while True:
+        try:
+            conn = listener.accept()
+        except multiprocessing.AuthenticationError:
+            continue
+        except OSError:
+            return
+        threading.Thread(target=_receive, args=(conn, requests), daemon=True).start()
+
+
+def _wait_for_close(control, requests):
+    # close() sends None, if the parent died the pipe is closed
+    try:
+        control.recv()
+    except (EOFError, OSError):
+        pass
+    requests.put(None)
+
+
+def _serve(model_path, authkey, control, num_threads, max_batch_size, batch_window):
+    if num_threads > 0:
+        configure_threads(num_threads)
+    encoder = LazyEncoder(model_path)
+    requests = queue.Queue()
+    listener = Listener(("localhost", 0), authkey=authkey)
+    control.send(listener.address)
+    threading.Thread(target=_accept, args=(listener, requests), daemon=True).start()
+    threading.Thread(target=_wait_for_close, args=(control, requests), daemon=True).start()
+
+    stopped = False
+    while not stopped:
+        request = requests.get()
+        if request is None:
+            break
+        batch = [request]
+        num_texts = len(request[1])
+        deadline = time.monotonic() + batch_window
+        while num_texts < max_batch_size:
+            try:
+                request = requests.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is None:
+                stopped = True
+                break
+            batch.append(request)
+            num_texts += len(request[1])
+
+        # one encoder call for the distinct texts of all coalesced requests
+        texts = list(dict.fromkeys(text for _, request_texts in batch for text in request_texts))
+        try:
+            embeddings = encoder(texts) if texts else np.zeros((0, 512), dtype=np.float32)
+            embeddings = np.asarray(embeddings.numpy() if hasattr(embeddings, "numpy") else embeddings, dtype=np.float32)
+            rows = {text: row for row, text in enumerate(texts)}
+            replies = [embeddings[[rows[text] for text in request_texts]] for _, request_texts in batch]
+        except Exception as e:
+            replies = [e] * len(batch)
+        for (conn, _), reply in zip(batch, replies):
+            try:
+                conn.send(reply)
+            except OSError:
+                pass
+    listener.close()
+
+
+def embedding_server_model():
+    """Model path to start the embedding server of the workers with, None without RLDS_EMBEDDING_SERVER.
+
+    Builds with precomputed embeddings (RLDS_EMBEDDING_TABLE) do not start a server.
+    """
+    if settings.EMBEDDING_SERVER and not settings.EMBEDDING_TABLE:
+        return settings.EMBEDDING_MODEL
+    return None
@@ -0,0 +1,58 @@
+import numpy as np
+
+# storage dtypes of language embeddings, int8 embeddings are stored with a float32 scale per vector
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def _check_dtype(dtype):
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"unknown embedding dtype {dtype}, expected one of {EMBEDDING_DTYPES}")
+
+
+def embedding_features(name, shape, doc, dtype="float32"):
+    """Features of an embedding named name of the given shape, stored with dtype.
+
+    int8 embeddings get the additional feature <name>_scale with one scale per vector.
+    """
+    import tensorflow_datasets as tfds
+    _check_dtype(dtype)
+    features = {name: tfds.features.Tensor(shape=shape, dtype=getattr(np, dtype), doc=doc)}
+    if dtype == "int8":
+        features[name + "_scale"] = tfds.features.Tensor(
+            shape=shape[:-1],
+            dtype=np.float32,
+            doc=f'Scale of every vector of {name}, multiply with it to dequantize {name} to float32.',
+        )
+    return features
+
+
+def quantize_embedding(name, embedding, dtype="float32"):
+    """Example fields of embedding_features(name, ..., dtype) for a float32 embedding."""
+    _check_dtype(dtype)
+    embedding = np.asarray(embedding, dtype=np.float32)
+    if dtype != "int8":
+        return {name: embedding.astype(dtype)}
+    # symmetric per vector quantization, zero vectors (no language) keep a zero scale
+    scale = np.abs(embedding).max(axis=-1) / 127
+    quantized = np.round(embedding / np.where(scale > 0, scale, 1)[..., None])
+    return {name: quantized.astype(np.int8), name + "_scale": scale.astype(np.float32)}
+
+
+def dequantize_embedding(embedding, scale=None):
+    """float32 embedding of a float16 or int8 (with its scale) embedding, for numpy arrays and tf tensors."""
+    if isinstance(embedding, np.ndarray):
+        embedding = embedding.astype(np.float32)
+        return embedding if scale is None else embedding * np.asarray(scale, dtype=np.float32)[..., None]
+    import tensorflow as tf
+    embedding = tf.cast(embedding, tf.float32)
+    return embedding if scale is None else embedding * tf.cast(scale, tf.float32)[..., None]
+
+
+def dequantize_features(features, name="language_embedding"):
+    """Replaces the embedding name of a step or episode_metadata dict with its float32 version.
+
+    Can be used in a tf.data map, e.g. dataset.map(lambda step: dequantize_features(step)).
+    """
+    features = dict(features)
+    features[name] = dequantize_embedding(features[name], features.pop(name + "_scale", None))
+    return features
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from conversion_utils.discovery import is_derived
+from conversion_utils.images import encode_rgb
+
+# modules whose code shapes the examples besides the builder itself
+_EXAMPLE_MODULES = ("images.py", "embedding.py", "embedding_storage.py")
+
+
+def source_fingerprint(source_files, *parts):
+    """sha1 of the contents of source_files, the conversion_utils modules that shape examples and the repr of parts.
+
+    parts are e.g. the features, the version and settings.output_settings() of a builder.
+    """
+    utils_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for file_path in list(source_files) + [os.path.join(utils_dir, module) for module in _EXAMPLE_MODULES]:
+        with open(file_path, "rb") as f:
+            digest.update(f.read())
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _episode_files(path):
+    # (path, size, mtime) of all files of an episode, recursively. the files the conversion tools write next to the
+    # raw data (frame packs, pickle sidecars) are left out, writing them does not change the episode
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if is_derived(entry.name):
+                continue
+            if entry.is_dir():
+                files += _episode_files(entry.path)
+            else:
+                stat = entry.stat()
+                files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    return files
+
+
+class EpisodeCache:
+    """Cache of parsed examples, one file per episode.
+
+    An episode is keyed by the paths, sizes and modification times of its files and the fingerprint of the builder,
+    so a rebuild reuses the examples of unchanged episodes. The frames of the observation keys in image_encodings
+    are stored encoded (e.g. {'image_0': 'jpeg'}), tfds stores the bytes as they are. The files of the episodes are
+    listed and stat-ed in num_threads threads.
+    """
+
+    def __init__(self, cache_dir, fingerprint, image_encodings, num_threads=16):
+        self._cache_dir = cache_dir
+        self._num_threads = num_threads
+        self._fingerprint = fingerprint
+        self._image_encodings = image_encodings
+        self._keys = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, episode_path):
+        if episode_path not in self._keys:
+            digest = hashlib.sha1(self._fingerprint.encode("utf-8"))
+            digest.update(repr((episode_path, sorted(_episode_files(episode_path)))).encode("utf-8"))
+            self._keys[episode_path] = digest.hexdigest()
+        key = self._keys[episode_path]
+        return os.path.join(self._cache_dir, key[:2], key + ".pkl")
+
+    def partition(self, episode_paths):
+        """Splits episode_paths into the cached and the uncached episodes, the uncached ones count as misses."""
+        # the keys stat every file of an episode, the stats of many episodes overlap in threads
+        with ThreadPoolExecutor(max(self._num_threads, 1)) as pool:
+            found = list(pool.map(lambda episode_path: os.path.isfile(self._file(episode_path)), episode_paths))
+        cached, uncached = [], []
+        for episode_path, is_cached in zip(episode_paths, found):
+            (cached if is_cached else uncached).append(episode_path)
+        self.misses += len(uncached)
+        return cached, uncached
+
+    def load(self, episode_path):
+        """Returns (True, cached example) of an episode, the example is None for skipped episodes.
+
+        Returns (False, None) if the cache file can not be read, the episode then counts as miss.
+        """
+        try:
+            with open(self._file(episode_path), "rb") as f:
+                example = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, example
+
+    def encode(self, example):
+        """Encodes the frames of an example, frames shared by several steps (e.g. padding) are encoded once."""
+        if example is None:
+            return None
+        key, sample = example
+        encoded = {}
+        for step in sample['steps']:
+            observation = step['observation']
+            for name, encoding_format in self._image_encodings.items():
+                frame = observation.get(name)
+                if isinstance(frame, np.ndarray) and frame.ndim == 3:
+                    if id(frame) not in encoded:
+                        encoded[id(frame)] = (frame, encode_rgb(frame, encoding_format))
+                    observation[name] = encoded[id(frame)][1]
+        return key, sample
+
+    def store(self, episode_path, example):
+        """Encodes the frames of an example, writes it to the cache and returns it."""
+        example = self.encode(example)
+        file_path = self._file(episode_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # written to a temporary file first, so that aborted builds leave no partial examples
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(example, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return example
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        if total:
+            print(f"episode cache: {self.hits} hits, {self.misses} misses, hit rate {self.hits / total:.1%}")
@@ -0,0 +1,29 @@
+# Sequence(Text) fields of the episode level language schema (bridge/episode_language) and the per step fields
+# they replace, the i-th text is <prefix>_<i>, the first one <prefix>
+BRIDGE_SEQUENCE_FIELDS = {'language_instructions': 'language_instruction', 'groundtruths': 'groundtruth'}
+BRIDGE_TENSOR_FIELDS = ('language_embedding', 'language_embedding_scale')
+
+
+def broadcast_language(episode, sequence_fields=None, tensor_fields=BRIDGE_TENSOR_FIELDS, length=12):
+    """Adds the episode level language fields of episode_metadata to every step of an RLDS episode.
+
+    The fields are added lazily in a map of the steps dataset, so consumers that expect the per step schema
+    can read datasets built with the episode_language config of bridge, e.g. dataset.map(broadcast_language).
+    """
+    sequence_fields = BRIDGE_SEQUENCE_FIELDS if sequence_fields is None else sequence_fields
+    metadata = episode['episode_metadata']
+
+    def add_language(step):
+        step = dict(step)
+        for sequence_name, prefix in sequence_fields.items():
+            if sequence_name in metadata:
+                for i in range(length):
+                    step[prefix if i == 0 else f'{prefix}_{i}'] = metadata[sequence_name][i]
+        for name in tensor_fields:
+            if name in metadata:
+                step[name] = metadata[name]
+        return step
+
+    episode = dict(episode)
+    episode['steps'] = episode['steps'].map(add_language)
+    return episode
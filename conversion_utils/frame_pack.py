@@ -0,0 +1,153 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+
+# File of the packed frames of a camera directory, next to the frames it packs. Layout:
+#   MAGIC, the encoded frames one after the other, the json index, footer (index offset, index size, dir mtime_ns), MAGIC
+# The index maps every frame file name to [offset, size, crc32, mtime_ns] of its bytes, size and mtime_ns are the size
+# and modification time of the frame file when it was packed. dir mtime_ns is the modification time of the camera
+# directory after the pack was written, it changes when a frame file is added, removed or replaced.
+PACK_NAME = "frames.pack"
+MAGIC = b"RLDSPAK2"
+_FOOTER = struct.Struct("<QQQ")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+class PackedFrame:
+    """Encoded bytes of a frame in a FramePack, used like the path of the frame file by images.load_frames."""
+
+    __slots__ = ("path", "data")
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+
+    def __str__(self):
+        return self.path
+
+
+class FramePack:
+    """Memory mapped pack of the frames of a camera directory."""
+
+    def __init__(self, pack_path):
+        with open(pack_path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_start = len(self._buffer) - _FOOTER.size - len(MAGIC)
+        if self._buffer[:len(MAGIC)] != MAGIC or self._buffer[footer_start + _FOOTER.size:] != MAGIC:
+            raise ValueError(f"{pack_path} is no complete frame pack")
+        index_offset, index_size, self.dir_mtime_ns = _FOOTER.unpack_from(self._buffer, footer_start)
+        self.index = json.loads(self._buffer[index_offset:index_offset + index_size].decode("utf-8"))
+        self._camera_dir = os.path.dirname(pack_path)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def is_current_dir(self):
+        """True if no frame file of the camera directory was added, removed or replaced since it was packed.
+
+        Only stats the directory, frames overwritten in place are found by is_current and pack_frames --verify.
+        """
+        try:
+            return os.stat(self._camera_dir).st_mtime_ns == self.dir_mtime_ns
+        except OSError:
+            return False
+
+    def is_current(self, name):
+        """True if the frame file still has the size and modification time of its packed bytes."""
+        entry = self.index.get(name)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(os.path.join(self._camera_dir, name))
+        except OSError:
+            return False
+        return stat.st_size == entry[1] and stat.st_mtime_ns == entry[3]
+
+    def frame(self, name):
+        offset, size = self.index[name][:2]
+        return PackedFrame(os.path.join(self._camera_dir, name), memoryview(self._buffer)[offset:offset + size])
+
+    def verify(self, check_sources=False):
+        """Names of the frames whose bytes do not match their crc32 or whose frame file changed since it was packed.
+
+        With check_sources, the packed bytes are also compared with the frame files.
+        """
+        corrupt = []
+        for name, (offset, size, crc, _) in self.index.items():
+            data = self._buffer[offset:offset + size]
+            if zlib.crc32(data) != crc or not self.is_current(name):
+                corrupt.append(name)
+            elif check_sources:
+                try:
+                    with open(os.path.join(self._camera_dir, name), "rb") as f:
+                        if f.read() != data:
+                            corrupt.append(name)
+                except OSError:
+                    corrupt.append(name)
+        return corrupt
+
+
+def is_pack(name):
+    # also the temporary file of a pack that is being written
+    return name.startswith(PACK_NAME)
+
+
+def open_pack(camera_dir):
+    """FramePack of a camera directory, None if it has none."""
+    try:
+        return FramePack(os.path.join(camera_dir, PACK_NAME))
+    except (OSError, ValueError):
+        return None
+
+
+def image_names(camera_dir):
+    return sorted(name for name in os.listdir(camera_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def pack_camera(camera_dir):
+    """Packs the frames of a camera directory, returns False if an existing pack already holds exactly these frames.
+
+    A pack is up to date if it holds the same frame names, the directory was not changed since it was packed and every
+    frame file still has the size and modification time it was packed with, frames replaced in place are packed again.
+    The pack is written to a temporary file that replaces the pack only when it is complete, so interrupted packing is
+    resumed by packing the directory again.
+    """
+    names = image_names(camera_dir)
+    pack = open_pack(camera_dir)
+    if (pack is not None and sorted(pack.index) == names and pack.is_current_dir()
+            and all(pack.is_current(name) for name in names)):
+        return False
+    pack_path = os.path.join(camera_dir, PACK_NAME)
+    tmp_path = pack_path + ".tmp"
+    index = {}
+    with open(tmp_path, "wb") as pack_file:
+        pack_file.write(MAGIC)
+        for name in names:
+            with open(os.path.join(camera_dir, name), "rb") as f:
+                # stat before reading, a frame changed while it is read then has a newer mtime than recorded
+                mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+                data = f.read()
+            index[name] = [pack_file.tell(), len(data), zlib.crc32(data), mtime_ns]
+            pack_file.write(data)
+        index_offset = pack_file.tell()
+        encoded_index = json.dumps(index).encode("utf-8")
+        pack_file.write(encoded_index)
+        pack_file.write(_FOOTER.pack(index_offset, len(encoded_index), 0))
+        pack_file.write(MAGIC)
+    os.replace(tmp_path, pack_path)
+    # the directory has its final modification time once the pack is in place, writing into the pack keeps it
+    with open(pack_path, "r+b") as pack_file:
+        pack_file.seek(-len(MAGIC) - 8, os.SEEK_END)
+        pack_file.write(struct.pack("<Q", os.stat(camera_dir).st_mtime_ns))
+    return True
+
+
+def camera_dirs(episode_path):
+    """The directories below an episode that contain frames."""
+    dirs = []
+    for dir_path, _, file_names in os.walk(episode_path):
+        if any(name.lower().endswith(IMAGE_EXTENSIONS) for name in file_names):
+            dirs.append(dir_path)
+    return sorted(dirs)
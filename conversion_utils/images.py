@@ -0,0 +1,198 @@
+import functools
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from conversion_utils.frame_pack import PackedFrame, open_pack
+from conversion_utils.threads import get_thread_budget
+
+# decode pools by number of threads, created once per process
+_decode_pools = {}
+
+
+def _read_bgr(img_path):
+    # img_path is the path of a frame file or a PackedFrame of a frame pack
+    if isinstance(img_path, PackedFrame):
+        return cv2.imdecode(np.frombuffer(img_path.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(img_path)
+
+
+def _read_encoded(img_path, size=-1):
+    if isinstance(img_path, PackedFrame):
+        return img_path.data if size < 0 else img_path.data[:size]
+    with open(img_path, 'rb') as f:
+        return f.read(size)
+
+
+def read_rgb(img_path):
+    return cv2.cvtColor(_read_bgr(img_path), cv2.COLOR_RGB2BGR)
+
+
+def read_rgb_into(img_path, out):
+    """Decodes img_path and writes the RGB frame into out, e.g. the slice of a preallocated episode tensor."""
+    frame = _read_bgr(img_path)
+    if frame is None:
+        raise ValueError(f"could not read image {img_path}")
+    if frame.shape != out.shape:
+        raise ValueError(f"{img_path} has shape {frame.shape}, expected {out.shape}")
+    # the channel swap writes straight into out instead of allocating another frame
+    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=out)
+
+
+def read_image_shape(img_path):
+    """Shape of the RGB frame img_path decodes to, from the file header if possible."""
+    header = read_image_header(_read_encoded(img_path, 1 << 16))
+    if header is not None:
+        return header[1], header[2], 3
+    return read_rgb(img_path).shape
+
+
+def read_image_header(encoded):
+    """Returns (encoding_format, height, width, channels) of encoded jpeg or png bytes, None for anything else.
+
+    Only the file header is inspected, the image is not decoded.
+    """
+    if encoded[:8] == b'\x89PNG\r\n\x1a\n' and encoded[12:16] == b'IHDR':
+        width, height, bit_depth, color_type = struct.unpack('>IIBB', encoded[16:26])
+        # only 8 bit RGB pngs decode to the (h, w, 3) uint8 arrays we store
+        channels = {0: 1, 2: 3, 4: 2, 6: 4}.get(color_type)
+        if bit_depth != 8 or channels is None:
+            return None
+        return 'png', height, width, channels
+    if encoded[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 4 <= len(encoded):
+        if encoded[pos] != 0xFF:
+            return None
+        marker = encoded[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        length = struct.unpack('>H', encoded[pos + 2:pos + 4])[0]
+        # start of frame markers, except DHT (c4), JPG (c8) and DAC (cc)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            precision, height, width, channels = struct.unpack('>BHHB', encoded[pos + 4:pos + 10])
+            if precision != 8:
+                return None
+            return 'jpeg', height, width, channels
+        pos += 2 + length
+    return None
+
+
+def read_passthrough(img_path, shape, encoding_format):
+    """Returns the encoded bytes of img_path if they can be stored as they are in an Image feature with the given
+    shape and encoding format, otherwise None.
+
+    The stored frames are RGB. Jpegs with 3 components and 8 bit RGB pngs decode to RGB, so only the header
+    has to be checked.
+    """
+    encoded = _read_encoded(img_path)
+    header = read_image_header(encoded)
+    if header is None or header != (encoding_format, *shape):
+        return None
+    return bytes(encoded)
+
+
+def encode_rgb(frame, encoding_format):
+    """Encodes an RGB frame like tfds.features.Image does, so tfds can store the bytes as they are."""
+    bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    if encoding_format == 'png':
+        # zlib level 6 is the default of tf.image.encode_png
+        ok, encoded = cv2.imencode('.png', bgr, [cv2.IMWRITE_PNG_COMPRESSION, 6])
+    else:
+        # quality 95 is the default of tf.image.encode_jpeg
+        ok, encoded = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise ValueError(f"could not encode frame as {encoding_format}")
+    return encoded.tobytes()
+
+
+@functools.lru_cache(maxsize=None)
+def padding(shape):
+    """Frame of ones, used as padding for missing cameras. Created once and shared, so it is read only."""
+    frame = np.ones(shape, dtype=np.uint8)
+    frame.setflags(write=False)
+    return frame
+
+
+@functools.lru_cache(maxsize=None)
+def encoded_padding(shape, encoding_format):
+    """Encoded frame of ones, used as padding for missing cameras."""
+    return encode_rgb(padding(shape), encoding_format)
+
+
+def _load_frame(img_path, feature=None, passthrough=False, encode=False):
+    if feature is not None and passthrough:
+        encoded = read_passthrough(img_path, *feature)
+        if encoded is not None:
+            return encoded
+    frame = read_rgb(img_path)
+    if feature is not None and encode:
+        return encode_rgb(frame, feature[1])
+    return frame
+
+
+def _get_decode_pool(num_threads):
+    if num_threads not in _decode_pools:
+        _decode_pools[num_threads] = ThreadPoolExecutor(num_threads, thread_name_prefix="decode")
+    return _decode_pools[num_threads]
+
+
+def _packed_frames(paths):
+    # the frames of a camera from the frame pack of their directory, if it holds all of them and no frame file of the
+    # directory was added, removed or replaced since it was packed, otherwise the frame files are read
+    if not paths or isinstance(paths[0], PackedFrame):
+        return paths
+    camera_dir = os.path.dirname(paths[0])
+    pack = open_pack(camera_dir)
+    if pack is None or not pack.is_current_dir() or not all(
+            os.path.dirname(path) == camera_dir and os.path.basename(path) in pack for path in paths):
+        return paths
+    return [pack.frame(os.path.basename(path)) for path in paths]
+
+
+def load_frames(frame_paths, num_threads=0, features=None, passthrough=False, encode=False):
+    """Decodes the frames of all cameras of an episode.
+
+    frame_paths maps a camera name to the paths of its frames. The result maps the camera name to one
+    contiguous (T, H, W, 3) uint8 RGB tensor, every frame is decoded straight into its slice. With
+    num_threads > 1 all frames are decoded concurrently, cv2 releases the GIL while decoding. num_threads is
+    capped at the thread budget of the process, see threads.configure_threads.
+    features optionally maps a camera name to the (shape, encoding_format) of its Image feature. For these
+    cameras, passthrough returns frames that are already encoded that way as their file bytes, and encode
+    returns all other frames encoded instead of decoded. tfds stores encoded bytes without re-encoding them.
+    Cameras with passthrough or encode are returned as lists of frames.
+    The frames of a camera directory packed by conversion_utils/pack_frames.py are read from its memory mapped
+    frame pack instead of one file per frame.
+    """
+    features = features or {}
+    frames = {}
+    tasks = []
+    for cam, paths in frame_paths.items():
+        paths = _packed_frames(paths)
+        feature = features.get(cam)
+        if feature is not None and (passthrough or encode):
+            frames[cam] = [None] * len(paths)
+            tasks += [(cam, i, _load_frame, (img_path, feature, passthrough, encode)) for i, img_path in enumerate(paths)]
+        elif not paths:
+            frames[cam] = []
+        else:
+            shape = feature[0] if feature is not None else read_image_shape(paths[0])
+            frames[cam] = np.empty((len(paths), *shape), dtype=np.uint8)
+            tasks += [(cam, i, read_rgb_into, (img_path, frames[cam][i])) for i, img_path in enumerate(paths)]
+
+    if get_thread_budget() is not None:
+        num_threads = min(num_threads, get_thread_budget())
+    if num_threads <= 1:
+        results = [fn(*args) for _, _, fn, args in tasks]
+    else:
+        pool = _get_decode_pool(num_threads)
+        results = [future.result() for future in [pool.submit(fn, *args) for _, _, fn, args in tasks]]
+    for (cam, i, fn, _), result in zip(tasks, results):
+        if fn is _load_frame:
+            frames[cam][i] = result
+    return frames
@@ -0,0 +1,68 @@
+import argparse
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from conversion_utils.frame_pack import camera_dirs, open_pack, pack_camera
+
+# Packs the frames of every camera directory of the episodes of a builder into one frames.pack file per directory,
+# so builds read one memory mapped file per camera instead of opening thousands of small frame files, e.g.:
+#   python3 -m conversion_utils.pack_frames bridge.bridge_dataset_builder --data_path /home/marcelr/BridgeData/raw
+#   python3 -m conversion_utils.pack_frames kit_irl_real_kitchen_lang.kit_irl_real_kitchen_lang --verify
+# Running it again only packs the directories without a complete pack of their current frames (same names, sizes and
+# modification times), so an interrupted run is resumed. --verify checks the crc32 of every packed frame and the size
+# and modification time of its frame file, --check_sources compares them with the frame files.
+
+
+def pack_episode(episode_path):
+    # (packed, up to date) camera directories of an episode
+    packed, up_to_date = 0, 0
+    for camera_dir in camera_dirs(episode_path):
+        if pack_camera(camera_dir):
+            packed += 1
+        else:
+            up_to_date += 1
+    return packed, up_to_date
+
+
+def verify_episode(episode_path, check_sources=False):
+    # problems of the frame packs of an episode
+    problems = []
+    for camera_dir in camera_dirs(episode_path):
+        pack = open_pack(camera_dir)
+        if pack is None:
+            problems.append(f"{camera_dir}: no frame pack")
+            continue
+        problems += [f"{camera_dir}: {name} does not match" for name in pack.verify(check_sources)]
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('builder', help='builder module that defines get_episode_paths(path)')
+    parser.add_argument('--data_path', help='raw data path of the builder, defaults to the data_path of the module')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--verify', action='store_true', help='verify the existing packs instead of packing')
+    parser.add_argument('--check_sources', action='store_true', help='with --verify, compare with the frame files')
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.builder)
+    data_path = args.data_path or getattr(module, "data_path", None)
+    if data_path is None:
+        parser.error(f"{args.builder} has no module level data_path, pass --data_path")
+    episode_paths = module.get_episode_paths(data_path)
+    with ProcessPoolExecutor(args.num_workers) as pool:
+        if args.verify:
+            num_problems = 0
+            for problems in pool.map(partial(verify_episode, check_sources=args.check_sources), episode_paths, chunksize=16):
+                for problem in problems:
+                    print(problem)
+                num_problems += len(problems)
+            print(f"verified the frame packs of {len(episode_paths)} episodes, {num_problems} problems")
+        else:
+            num_packed, num_up_to_date = 0, 0
+            for packed, up_to_date in pool.map(pack_episode, episode_paths, chunksize=16):
+                num_packed += packed
+                num_up_to_date += up_to_date
+            print(f"packed {num_packed} camera directories of {len(episode_paths)} episodes, {num_up_to_date} were up to date")
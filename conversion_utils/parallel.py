@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import time
+from collections import defaultdict, deque
+
+from conversion_utils import settings
+from conversion_utils.discovery import estimate_episode_costs
+from conversion_utils.embedding import print_embedding_stats
+from conversion_utils.embedding_server import EmbeddingServer, embedding_server_model
+from conversion_utils.episode_cache import EpisodeCache, source_fingerprint
+from conversion_utils.shared_episodes import create_scratch_dir, receive_example, share_example
+from conversion_utils.threads import configure_threads, threads_per_process
+
+# state of a parse worker process, set up once per process by _init_worker
+_worker_parse_fn = None
+_worker_embed = None
+_worker_scratch_dir = None
+_worker_cache = None
+
+
+def _init_worker(parse_fn, embed_loader, scratch_dir, num_threads, encoder, cache):
+    global _worker_parse_fn, _worker_embed, _worker_scratch_dir, _worker_cache
+    # before loading the embed, so that its runtime starts with the limited thread pools
+    configure_threads(num_threads)
+    _worker_parse_fn = parse_fn
+    if embed_loader is not None:
+        _worker_embed = embed_loader(encoder) if encoder is not None else embed_loader()
+    _worker_scratch_dir = scratch_dir
+    _worker_cache = cache
+
+
+def _run_worker(episode_path):
+    start = time.perf_counter()
+    example = _worker_parse_fn(episode_path, _worker_embed)
+    if _worker_cache is not None:
+        example = _worker_cache.store(episode_path, example)
+    if example is not None and _worker_scratch_dir is not None:
+        example = share_example(example, _worker_scratch_dir)
+    stats = _worker_embed.stats() if hasattr(_worker_embed, "stats") else None
+    return example, os.getpid(), time.perf_counter() - start, stats
+
+
+def _windowed_results(pool, episode_paths, window, ordered):
+    # results of _run_worker for all episodes with at most window episodes submitted but not yet consumed, so
+    # parsed episodes do not pile up in the parent while the writer is slower than the workers.
+    # the first window episodes are submitted right away, the next one whenever a result was consumed
+    paths = iter(episode_paths)
+    pending = deque()
+    finished = queue.Queue()
+
+    def submit():
+        episode_path = next(paths, None)
+        if episode_path is None:
+            return
+        if ordered:
+            pending.append(pool.apply_async(_run_worker, (episode_path,)))
+        else:
+            pending.append(None)
+            pool.apply_async(_run_worker, (episode_path,), callback=finished.put, error_callback=finished.put)
+
+    def consume():
+        while pending:
+            if ordered:
+                result = pending.popleft().get()
+            else:
+                pending.popleft()
+                result = finished.get()
+                if isinstance(result, BaseException):
+                    raise result
+            yield result
+            submit()
+
+    for _ in range(window):
+        submit()
+    return consume()
+
+
+def _add_repo_root_to_path():
+    # tfds only puts the repo root on sys.path while importing the builder, spawned workers need it
+    # to import the builder module and conversion_utils again
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+
+
+def _print_utilization(busy_times, num_workers, wall_time):
+    print(f"parsed episodes in {wall_time:.1f}s with {num_workers} workers")
+    for worker, (pid, busy_time) in enumerate(sorted(busy_times.items())):
+        print(f"  worker {worker} (pid {pid}): busy {busy_time:.1f}s, utilization {busy_time / wall_time:.1%}")
+    print(f"  mean utilization: {sum(busy_times.values()) / (num_workers * wall_time):.1%}")
+
+
+def parse_episodes(episode_paths, parse_fn, embed=None, embed_loader=None, num_workers=0, ordered=True,
+                   shared_memory=False, costs=None, num_cpus=None, embedding_server=None, embedding_server_threads=0,
+                   cache=None, max_in_flight=None):
+    """Yields parse_fn(episode_path, embed) for all episodes, skipping episodes parsed to None.
+
+    With num_workers > 0 the episodes are parsed by a pool of worker processes. parse_fn and embed_loader
+    have to be module level functions, every worker calls embed_loader once to create its own embed.
+    If ordered is False, the examples are yielded as soon as they are done instead of in input order.
+    At most max_in_flight episodes (default: 2 * num_workers) are parsed or waiting to be consumed at a time.
+    With shared_memory, the workers hand over the arrays of an example in shared memory instead of pickling them,
+    the max_in_flight window also bounds the number of episode files in the scratch directory.
+    costs optionally maps the episode paths to their estimated parse cost. If ordered is False, the most expensive
+    episodes are dispatched first so that no worker is left with a large episode at the end, ordered parsing keeps
+    the discovery order. The per worker utilization
+    is printed when all episodes are parsed.
+    The num_cpus cores (default: all) are divided between the workers, every worker limits its thread pools
+    to its share.
+    With embedding_server (a tfhub url or SavedModel path), one EmbeddingServer process holds the sentence
+    encoder instead of every worker, the workers create their embed with embed_loader(encoder) from a
+    RemoteEncoder of the server. The server is stopped when parsing ends. Every worker depends on the server, so it
+    gets its own budget of embedding_server_threads threads, by default all num_cpus cores, since the workers
+    mostly wait for it while it embeds.
+    With an EpisodeCache, the cached examples of unchanged episodes are yielded first, the other episodes
+    are parsed and stored in the cache. All examples are yielded with the frames encoded by the cache.
+    """
+    cached_paths = []
+    if cache is not None:
+        cached_paths, episode_paths = cache.partition(episode_paths)
+
+    if num_workers <= 0:
+        for episode_path in cached_paths:
+            found, example = cache.load(episode_path)
+            if not found:
+                example = cache.store(episode_path, parse_fn(episode_path, embed))
+            if example is not None:
+                yield example
+        for episode_path in episode_paths:
+            example = parse_fn(episode_path, embed)
+            if cache is not None:
+                example = cache.store(episode_path, example)
+            if example is not None:
+                yield example
+        if hasattr(embed, "stats"):
+            print_embedding_stats([embed.stats()])
+        if cache is not None:
+            cache.print_stats()
+        return
+
+    if costs is not None and not ordered:
+        episode_paths = sorted(episode_paths, key=lambda path: costs.get(path, 0), reverse=True)
+    _add_repo_root_to_path()
+    num_threads = threads_per_process(num_cpus or os.cpu_count() or 1, num_workers)
+    # the main process only serializes, but its thread pools must not compete with the workers either
+    configure_threads(num_threads)
+    scratch_dir = create_scratch_dir() if shared_memory else None
+    server = None
+    busy_times = defaultdict(float)
+    embedding_stats = {}
+    start = time.perf_counter()
+    # spawn instead of fork, forking a process with an initialized tensorflow runtime deadlocks
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        if embedding_server and embed_loader is not None:
+            server = EmbeddingServer(embedding_server, embedding_server_threads or num_cpus or os.cpu_count() or 1)
+        encoder = server.encoder() if server is not None else None
+        with ctx.Pool(num_workers, initializer=_init_worker, initargs=(parse_fn, embed_loader, scratch_dir, num_threads, encoder, cache)) as pool:
+            # one episode per task, so that every worker picks up the next episode as soon as it is done
+            results = _windowed_results(pool, episode_paths, max_in_flight or 2 * num_workers, ordered)
+            # the cached examples are loaded while the workers parse the other episodes
+            missing = []
+            for episode_path in cached_paths:
+                found, example = cache.load(episode_path)
+                if not found:
+                    missing.append(episode_path)
+                elif example is not None:
+                    yield example
+            for episode_path in missing:
+                example = cache.store(episode_path, parse_fn(episode_path, embed))
+                if example is not None:
+                    yield example
+            for example, pid, busy_time, stats in results:
+                busy_times[pid] += busy_time
+                if stats is not None:
+                    embedding_stats[pid] = stats
+                if example is None:
+                    continue
+                yield receive_example(example) if shared_memory else example
+        _print_utilization(busy_times, num_workers, time.perf_counter() - start)
+        print_embedding_stats(embedding_stats.values())
+        if cache is not None:
+            cache.print_stats()
+    finally:
+        if server is not None:
+            server.close()
+        if scratch_dir is not None:
+            # episodes that were parsed but never yielded, e.g. if the build was aborted
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def parse_builder_episodes(builder, episode_paths, parse_fn, source_file, image_encodings, embed=None,
+                           embed_loader=None):
+    """parse_episodes for the _generate_examples of a dataset builder, configured by conversion_utils.settings.
+
+    source_file is the builder module, image_encodings the encodings of its image features, the frames are stored
+    encoded like this in the episode cache. The episodes are parsed in the main process, with RLDS_NUM_WORKERS in
+    worker processes (that share one embedding server with RLDS_EMBEDDING_SERVER) and with RLDS_USE_BEAM in a Beam
+    pipeline, which has initialization overhead but scales to large datasets. Unordered, the workers get the largest episodes first,
+    with RLDS_EPISODE_CACHE the examples of unchanged episodes are reused from an earlier build of the builder
+    config.
+    """
+    if settings.USE_BEAM:
+        from conversion_utils.beam_utils import parse_episodes_beam
+        return parse_episodes_beam(episode_paths, parse_fn, embed_loader=embed_loader)
+
+    costs = None
+    if settings.NUM_WORKERS > 0 and settings.SCHEDULE_BY_SIZE and not settings.ORDERED:
+        costs = estimate_episode_costs(episode_paths, settings.MANIFEST_DIR, settings.DISCOVERY_THREADS)
+    cache = None
+    if settings.EPISODE_CACHE:
+        fingerprint = source_fingerprint([source_file], builder.info.features, builder.VERSION,
+                                         settings.output_settings())
+        cache_dir = os.path.join(settings.EPISODE_CACHE, builder.name)
+        if builder.builder_config is not None:
+            cache_dir = os.path.join(cache_dir, builder.builder_config.name)
+        cache = EpisodeCache(cache_dir, fingerprint, image_encodings, settings.DISCOVERY_THREADS)
+    return parse_episodes(episode_paths, parse_fn, embed=embed, embed_loader=embed_loader,
+                          num_workers=settings.NUM_WORKERS, ordered=settings.ORDERED,
+                          shared_memory=settings.SHARED_MEMORY, costs=costs, num_cpus=settings.NUM_CPUS,
+                          embedding_server=embedding_server_model(),
+                          embedding_server_threads=settings.EMBEDDING_SERVER_THREADS, cache=cache)
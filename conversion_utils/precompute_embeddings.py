@@ -0,0 +1,51 @@
+import argparse
+import csv
+import importlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from conversion_utils import settings
+from conversion_utils.embedding import LazyEncoder, write_embedding_table
+
+# Embeds all instructions of a dataset in large batches and writes them to a memory mapped table.
+# Builds with RLDS_EMBEDDING_TABLE=<table_dir> then look the embeddings up instead of loading the encoder.
+# The instructions are read from the raw episodes of a builder module that defines get_episode_paths(path) and
+# get_instructions(episode_path), or from the instruction CSVs of bridge/log_txt_as_csv.py, e.g.:
+#   python3 -m conversion_utils.precompute_embeddings <table_dir> --builder bridge.bridge_dataset_builder --data_path <path>
+#   python3 -m conversion_utils.precompute_embeddings <table_dir> --csv lang_lupus.csv
+# The CSV only holds the episodes with both a lupus annotation and a lang.txt, use --builder to cover all episodes.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('table_dir', help='directory to write the embedding table to')
+parser.add_argument('--csv', nargs='*', default=[], help='instruction CSVs with language_instruction_<i> columns')
+parser.add_argument('--builder', help='builder module to read the instructions of the raw episodes with')
+parser.add_argument('--data_path', help='raw data path of the builder, defaults to the data_path of the module')
+parser.add_argument('--model', default=settings.EMBEDDING_MODEL,
+                    help='tfhub url or local SavedModel path of the sentence encoder')
+parser.add_argument('--batch_size', type=int, default=1024)
+args = parser.parse_args()
+
+texts = []
+for csv_path in args.csv:
+    with open(csv_path, newline='') as csv_file:
+        for row in csv.DictReader(csv_file, delimiter=';'):
+            texts += [text for key, text in row.items() if key.startswith("language_instruction") and text]
+
+if args.builder:
+    module = importlib.import_module(args.builder)
+    data_path = args.data_path or getattr(module, "data_path", None)
+    if data_path is None:
+        parser.error(f"--data_path is required, {args.builder} has no module level data_path")
+    episode_paths = module.get_episode_paths(data_path)
+    with ThreadPoolExecutor(16) as pool:
+        for instructions in pool.map(module.get_instructions, episode_paths):
+            texts += instructions
+
+texts = list(dict.fromkeys(text.decode("utf-8") if isinstance(text, bytes) else str(text) for text in texts))
+print(f"{len(texts)} distinct instructions")
+
+encoder = LazyEncoder(args.model)
+write_embedding_table(texts, lambda batch: np.asarray(encoder(batch)), args.table_dir, args.batch_size)
+print("wrote embedding table to", os.path.abspath(args.table_dir))
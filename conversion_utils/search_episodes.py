@@ -0,0 +1,39 @@
+import argparse
+import time
+
+import numpy as np
+
+from conversion_utils import settings
+from conversion_utils.embedding import LazyEncoder
+from conversion_utils.search_index import EmbeddingIndex, index_dataset, write_index
+
+# Builds search indexes over the language embeddings of built datasets and finds the episodes most similar to an
+# instruction, e.g.:
+#   python3 -m conversion_utils.search_episodes build <index_dir> ~/tensorflow_datasets/bridge/default/1.0.2
+#   python3 -m conversion_utils.search_episodes query "put the pot on the burner" <index_dir> <other_index_dir> -k 20
+# Builds with RLDS_SEARCH_INDEX=<dir> write the index of the built episodes to <dir>/<dataset name>/<config>.
+# Every result has the split and index of the episode, load it with tfds.load(..., split='<split>[<index>:<index>+1]').
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest='command', required=True)
+build_parser = subparsers.add_parser('build', help='build a search index from existing datasets')
+build_parser.add_argument('index_dir')
+build_parser.add_argument('builder_dirs', nargs='+', help='dataset directories, e.g. ~/tensorflow_datasets/<name>/<version>')
+build_parser.add_argument('--split', default='train')
+query_parser = subparsers.add_parser('query', help='find the episodes most similar to an instruction')
+query_parser.add_argument('instruction')
+query_parser.add_argument('index_dirs', nargs='+')
+query_parser.add_argument('-k', type=int, default=10)
+args = parser.parse_args()
+
+if args.command == 'build':
+    write_index((entry for builder_dir in args.builder_dirs for entry in index_dataset(builder_dir, args.split)),
+                args.index_dir)
+else:
+    index = EmbeddingIndex(*args.index_dirs)
+    embedding = np.asarray(LazyEncoder(settings.EMBEDDING_MODEL)([args.instruction]))
+    start = time.perf_counter()
+    results = index.query(embedding, args.k)[0]
+    print(f"searched {len(index)} episodes in {(time.perf_counter() - start) * 1000:.1f}ms")
+    for key, score in results:
+        print(f"{score:.4f}  {key}")
@@ -0,0 +1,132 @@
+import json
+import os
+
+import numpy as np
+
+from conversion_utils.embedding_storage import dequantize_embedding
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def episode_embedding(episode):
+    """Instruction embedding of an episode (numpy example or tfds episode), None if it has no language.
+
+    Uses the episode_metadata language_embedding of the episode level schema, else the one of the first step.
+    Embeddings with several instructions (e.g. (3, 512)) are averaged.
+    """
+    metadata = episode.get('episode_metadata', {})
+    fields = metadata if 'language_embedding' in metadata else None
+    if fields is None:
+        steps = episode['steps']
+        fields = steps[0] if isinstance(steps, list) else next(iter(steps.take(1)))
+    embedding = fields['language_embedding']
+    scale = fields.get('language_embedding_scale')
+    embedding = np.asarray(dequantize_embedding(np.asarray(embedding), None if scale is None else np.asarray(scale)))
+    embedding = embedding.reshape(-1, embedding.shape[-1]).mean(axis=0)
+    if not embedding.any():
+        return None
+    return embedding
+
+
+def write_index(entries, index_dir):
+    """Writes (key, embedding) entries as a search index, keys are json serializable dicts.
+
+    The normalized embeddings are stored as float16 in embeddings.npy, the keys in keys.json.
+    """
+    keys, embeddings = [], []
+    for key, embedding in entries:
+        keys.append(key)
+        embeddings.append(embedding)
+    os.makedirs(index_dir, exist_ok=True)
+    embeddings = _normalize(embeddings) if embeddings else np.zeros((0, 512), dtype=np.float32)
+    np.save(os.path.join(index_dir, "embeddings.npy"), embeddings.astype(np.float16))
+    with open(os.path.join(index_dir, "keys.json"), "w") as f:
+        json.dump(keys, f)
+    print(f"wrote search index of {len(keys)} episodes to {index_dir}")
+
+
+def split_positions(keys, split="train"):
+    """Index of every example key in the built split, as used in split slices like train[<index>:<index>+1].
+
+    tfds writes the examples of a split ordered by the hash of their key salted with the split name.
+    """
+    from tensorflow_datasets.core import hashing
+    hasher = hashing.Hasher(salt=split)
+    order = sorted(range(len(keys)), key=lambda i: hasher.hash_key(keys[i]))
+    positions = [0] * len(keys)
+    for index, i in enumerate(order):
+        positions[i] = index
+    return positions
+
+
+def index_examples(examples, index_dir, dataset_name, split="train"):
+    """Yields the (key, example) tuples of a split and writes their search index when all are yielded.
+
+    Entries are addressed by split and index like those of index_dataset, with the example key and the file path
+    of the episode as metadata.
+    """
+    keys, entries = [], []
+    for key, example in examples:
+        embedding = episode_embedding(example)
+        if embedding is not None:
+            entries.append((len(keys), example['episode_metadata']['file_path'], embedding))
+        keys.append(key)
+        yield key, example
+    positions = split_positions(keys, split)
+    write_index((({"dataset": dataset_name, "split": split, "index": positions[i], "key": keys[i],
+                   "file_path": file_path}, embedding) for i, file_path, embedding in entries), index_dir)
+
+
+def index_dataset(builder_dir, split="train"):
+    """(key, embedding) entries of an existing dataset, keys address the episode as split[index:index+1]."""
+    import tensorflow_datasets as tfds
+    builder = tfds.builder_from_directory(builder_dir)
+    for index, episode in enumerate(builder.as_dataset(split=split)):
+        embedding = episode_embedding(episode)
+        if embedding is not None:
+            file_path = episode['episode_metadata']['file_path'].numpy().decode("utf-8")
+            yield {"dataset": builder_dir, "split": split, "index": index, "file_path": file_path}, embedding
+
+
+class EmbeddingIndex:
+    """Top-k cosine similarity search over the episode embeddings of one or more search indexes."""
+
+    def __init__(self, *index_dirs):
+        embeddings, self.keys = [], []
+        for index_dir in index_dirs:
+            embeddings.append(np.load(os.path.join(index_dir, "embeddings.npy")))
+            with open(os.path.join(index_dir, "keys.json")) as f:
+                self.keys += json.load(f)
+        # float32 in memory, numpy has no fast float16 matrix products
+        self._embeddings = np.concatenate(embeddings).astype(np.float32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def query(self, embeddings, k=10, block_size=65536):
+        """Returns the k most similar (key, score) pairs for every query embedding.
+
+        The similarities are computed in blocks of block_size episodes, only the k best of every block are kept.
+        """
+        queries = _normalize(np.atleast_2d(embeddings))
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.keys), block_size):
+            scores = queries @ self._embeddings[start:start + block_size].T
+            block_k = min(k, scores.shape[1])
+            rows = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, rows, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, rows + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [[(self.keys[row], float(score)) for row, score in zip(rows, scores)]
+                for rows, scores in zip(best_rows, best_scores)]
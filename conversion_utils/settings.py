@@ -0,0 +1,65 @@
+import os
+
+# Settings shared by all dataset builders. Every value can be overridden from the environment,
+# e.g. `RLDS_NUM_WORKERS=16 tfds build --overwrite`.
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ("1", "true", "yes")
+
+
+# number of worker processes used to parse episodes, 0 parses all episodes in the main process
+NUM_WORKERS = _env_int("RLDS_NUM_WORKERS", 0)
+# yield the parsed episodes in the order they were discovered, otherwise in the order they finish
+ORDERED = _env_bool("RLDS_ORDERED", True)
+# parse the episodes in an Apache Beam pipeline, run with tfds build --beam_pipeline_options=...
+USE_BEAM = _env_bool("RLDS_USE_BEAM", False)
+# number of threads decoding the frames of an episode, 0 decodes one frame after the other. Off by default, the
+# speedup on multi-core machines is unmeasured, check it with python3 -m conversion_utils.benchmark_decode
+DECODE_THREADS = _env_int("RLDS_DECODE_THREADS", 0)
+# store source frames that already have the encoding and shape of their Image feature without decoding them
+PASSTHROUGH = _env_bool("RLDS_PASSTHROUGH", False)
+# encode the frames in the parse workers, the main process then only serializes the encoded bytes
+ENCODE_FRAMES = _env_bool("RLDS_ENCODE_FRAMES", False)
+# hand over the arrays of parsed episodes from the workers in shared memory instead of pickling them
+SHARED_MEMORY = _env_bool("RLDS_SHARED_MEMORY", False)
+# number of threads listing directories while searching for episodes
+DISCOVERY_THREADS = _env_int("RLDS_DISCOVERY_THREADS", 16)
+# directory of the episode manifests that let later builds skip unchanged directories, empty to disable
+MANIFEST_DIR = os.environ.get("RLDS_MANIFEST_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rlds_dataset_builder"))
+# with RLDS_ORDERED=false, dispatch the largest episodes to the workers first, estimated from the size of their files
+SCHEDULE_BY_SIZE = _env_bool("RLDS_SCHEDULE_BY_SIZE", True)
+# cpus the conversion may use, divided between the worker processes to configure their thread pools
+NUM_CPUS = _env_int("RLDS_NUM_CPUS", os.cpu_count() or 1)
+# tfhub url or local SavedModel directory of the sentence encoder, loaded when the first instruction is embedded
+EMBEDDING_MODEL = os.environ.get("RLDS_EMBEDDING_MODEL", "https://tfhub.dev/google/universal-sentence-encoder-large/5")
+# with worker processes, load the sentence encoder once in an embedding server process that all workers query
+EMBEDDING_SERVER = _env_bool("RLDS_EMBEDDING_SERVER", False)
+# threads of the embedding server, 0 gives it all RLDS_NUM_CPUS cores since the workers mostly wait for it
+EMBEDDING_SERVER_THREADS = _env_int("RLDS_EMBEDDING_SERVER_THREADS", 0)
+# number of distinct instructions whose language embedding is kept in memory
+EMBEDDING_CACHE_SIZE = _env_int("RLDS_EMBEDDING_CACHE_SIZE", 4096)
+# directory of an embedding table written by conversion_utils/precompute_embeddings.py, embeddings are then
+# looked up in the table and the sentence encoder is not loaded
+EMBEDDING_TABLE = os.environ.get("RLDS_EMBEDDING_TABLE", "")
+# directory to write a search index of the language embeddings of the built episodes to, empty to disable
+SEARCH_INDEX = os.environ.get("RLDS_SEARCH_INDEX", "")
+# vanjani_basketball: directory of the numpy copies of the torch robot data streams, later builds memory map them
+# without torch, empty to disable
+STREAM_CACHE = os.environ.get("RLDS_STREAM_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "rlds_dataset_builder", "streams"))
+# directory of the episode cache that lets rebuilds reuse the parsed examples of unchanged episodes, empty to disable
+EPISODE_CACHE = os.environ.get("RLDS_EPISODE_CACHE", "")
+
+
+def output_settings():
+    """The settings that change the examples a builder generates, part of the episode cache key."""
+    return {
+        "PASSTHROUGH": PASSTHROUGH,
+        "ENCODE_FRAMES": ENCODE_FRAMES,
+        "EMBEDDING_MODEL": EMBEDDING_MODEL,
+        "EMBEDDING_TABLE": EMBEDDING_TABLE,
+    }
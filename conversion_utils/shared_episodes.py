@@ -0,0 +1,106 @@
+import mmap
+import os
+import tempfile
+
+import numpy as np
+
+# arrays whose memory is smaller than this are pickled with the rest of the example
+MIN_SHARED_BYTES = 4096
+_ALIGNMENT = 64
+
+
+class SharedArray:
+    """Placeholder for an array that was written to an episode file, see share_example."""
+
+    def __init__(self, offset, shape, strides, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.strides = strides
+        self.dtype = dtype
+
+
+def create_scratch_dir():
+    # files in /dev/shm live in memory, so writing and mapping them never touches the disk
+    return tempfile.mkdtemp(prefix="rlds_episodes_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+
+def _memory_root(array):
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def _address(array):
+    return array.__array_interface__['data'][0]
+
+
+def share_example(example, scratch_dir):
+    """Worker side of the episode transport.
+
+    Writes the memory of all arrays in example into one file in scratch_dir and replaces the arrays by
+    SharedArray placeholders. Arrays that are views of the same array (e.g. the frames of a camera tensor or
+    the rows of a state array) are written once. Returns the example and the file path, which are cheap to pickle.
+    """
+    roots = []
+    root_offsets = {}
+    size = 0
+
+    def replace(obj):
+        nonlocal size
+        if isinstance(obj, dict):
+            return {key: replace(value) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(replace(value) for value in obj)
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject or obj.nbytes == 0:
+            return obj
+        root = _memory_root(obj)
+        if not root.flags.c_contiguous:
+            obj = root = np.ascontiguousarray(obj)
+        if root.nbytes < MIN_SHARED_BYTES:
+            return obj
+        if id(root) not in root_offsets:
+            root_offsets[id(root)] = size
+            roots.append(root)
+            size += -(-root.nbytes // _ALIGNMENT) * _ALIGNMENT
+        offset = root_offsets[id(root)] + _address(obj) - _address(root)
+        return SharedArray(offset, obj.shape, obj.strides, obj.dtype)
+
+    example = replace(example)
+    if not roots:
+        return example, None
+
+    fd, episode_file = tempfile.mkstemp(suffix=".episode", dir=scratch_dir)
+    try:
+        os.ftruncate(fd, size)
+        with mmap.mmap(fd, size) as episode_map:
+            for root in roots:
+                np.ndarray(root.shape, root.dtype, buffer=episode_map, offset=root_offsets[id(root)])[...] = root
+    finally:
+        os.close(fd)
+    return example, episode_file
+
+
+def receive_example(shared_example):
+    """Parent side of the episode transport, maps the episode file of share_example without copying.
+
+    The file is unlinked right away, its memory is released as soon as the last array of the example is
+    garbage collected, i.e. once tfds serialized the example and moved on. parallel.parse_episodes only
+    submits a new episode when one was consumed, so the number of live files is bounded by its max_in_flight.
+    """
+    example, episode_file = shared_example
+    if episode_file is None:
+        return example
+    with open(episode_file, 'rb') as f:
+        episode_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    os.unlink(episode_file)
+
+    def restore(obj):
+        if isinstance(obj, dict):
+            return {key: restore(value) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(restore(value) for value in obj)
+        if isinstance(obj, SharedArray):
+            return np.ndarray(obj.shape, obj.dtype, buffer=episode_map, offset=obj.offset, strides=obj.strides)
+        return obj
+
+    return restore(example)
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# suffix of the numpy copy of a torch stream in the stream cache
+CACHE_SUFFIX = ".npy"
+
+# loads the streams of an episode next to the frame decoding, created once per process
+_stream_pool = None
+
+
+def _cache_path(cache_dir, path):
+    # numpy copy of a stream in cache_dir, keyed by the path, size and modification time of the stream
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key[:2], key + CACHE_SUFFIX)
+
+
+def _write_cache(cache_path, array):
+    # written to a temporary file first, so that aborted builds leave no partial copies
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=CACHE_SUFFIX + ".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_stream(path, cache_dir=None):
+    """Loads a tensor saved with torch.save as numpy array.
+
+    With cache_dir, a numpy copy of the stream is kept there and memory mapped without importing torch as long as
+    the stream is unchanged. Otherwise the tensor is memory mapped by torch.load(mmap=True) where torch and the file
+    format support it, and the numpy copy is written for the next build (skipped if cache_dir is not writable).
+    """
+    cache_path = None
+    if cache_dir:
+        cache_path = _cache_path(cache_dir, path)
+        try:
+            return np.load(cache_path, mmap_mode='r')
+        except OSError:
+            pass
+    import torch
+    try:
+        tensor = torch.load(path, map_location="cpu", mmap=True)
+    except (TypeError, RuntimeError):
+        # torch < 2.1 has no mmap, files of the legacy format can not be mapped
+        tensor = torch.load(path, map_location="cpu")
+    array = tensor.numpy()
+    if cache_path is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            _write_cache(cache_path, array)
+        except OSError:
+            pass
+    return array
+
+
+def _load_streams(stream_paths, cache_dir):
+    return {name: load_stream(path, cache_dir) for name, path in stream_paths.items()}
+
+
+def submit_streams(stream_paths, cache_dir=None):
+    """Starts loading the streams of an episode in a background thread, e.g. while its frames are decoded.
+
+    stream_paths maps a name to the path of its stream, the returned future resolves to a dict of name to array.
+    """
+    global _stream_pool
+    if _stream_pool is None:
+        _stream_pool = ThreadPoolExecutor(1, thread_name_prefix="streams")
+    return _stream_pool.submit(_load_streams, stream_paths, cache_dir)
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import cv2
+
+# threads this process may use, set by configure_threads
+_thread_budget = None
+
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS")
+
+
+def threads_per_process(num_cpus, num_processes):
+    return max(1, num_cpus // max(1, num_processes))
+
+
+def get_thread_budget():
+    return _thread_budget
+
+
+def configure_threads(num_threads):
+    """Limits the thread pools of tensorflow, cv2, torch, OpenMP and the frame decode pool of this process.
+
+    Call it in every worker process, with the number of cpus divided by the number of workers, so that the
+    workers together do not start more threads than there are cores. The environment variables are
+    inherited by processes started afterwards and limit libraries that are not initialized yet.
+    """
+    global _thread_budget
+    _thread_budget = num_threads
+    for env_var in _THREAD_ENV_VARS:
+        os.environ[env_var] = str(num_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(min(num_threads, 2))
+    cv2.setNumThreads(num_threads)
+    if "tensorflow" in sys.modules:
+        tf = sys.modules["tensorflow"]
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(min(num_threads, 2))
+        except RuntimeError:
+            # the runtime is already initialized, the TF_NUM_*_THREADS variables still apply to new processes
+            pass
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(num_threads)
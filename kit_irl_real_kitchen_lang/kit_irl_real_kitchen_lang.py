@@ -1,3 +1,5 @@
+import dataclasses
+import functools
 import os
 import cv2
 from typing import Iterator, Tuple, Any
@@ -7,25 +9,52 @@ import glob
 import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
-import tensorflow_hub as hub
 from tqdm import tqdm
 
+from conversion_utils import settings
+from conversion_utils.columnar import load_pickle
+from conversion_utils.discovery import find_episodes
+from conversion_utils.embedding import load_embed
+from conversion_utils.embedding_storage import EMBEDDING_DTYPES, embedding_features, quantize_embedding
+from conversion_utils.images import load_frames
+from conversion_utils.parallel import parse_builder_episodes
+from conversion_utils.search_index import index_examples
+
 tf.config.set_visible_devices([], "GPU")
 data_path = "/home/marcelr/rlds_dataset_builder/data/kit_irl_real_kitchen/lang"
 # data_path = "/home/marcelr/uha_test_policy/finetune_data/delta_des_joint_state_euler"
 # data_path = "/media/irl-admin/93a784d0-a1be-419e-99bd-9b2cd9df02dc1/preprocessed_data/upgraded_lab/quaternions_fixed/sim_to_polymetis/delta_des_joint_state"
 
+# encoding of the image feature of each observation
+IMAGE_ENCODINGS = {
+    'image_top': 'jpeg',
+    'image_side': 'jpeg',
+}
+
+@dataclasses.dataclass
+class KitIrlRealKitchenLangConfig(tfds.core.BuilderConfig):
+    """Storage variant of the dataset, every variant is built into its own directory."""
+    # storage dtype of the language embeddings: float32, float16 or int8 (with a float32 scale per vector)
+    embedding_dtype: str = 'float32'
+
 class KitIrlRealKitchenLang(tfds.core.GeneratorBasedBuilder):
     """DatasetBuilder for example dataset."""
 
-    VERSION = tfds.core.Version('1.0.0')
+    VERSION = tfds.core.Version('1.0.1')
     RELEASE_NOTES = {
       '1.0.0': 'Initial release.',
+      '1.0.1': 'Empty language instructions have a zero language embedding.',
     }
+    # a plain tfds build builds all three, build the float32 one with tfds build --config default
+    BUILDER_CONFIGS = [
+        KitIrlRealKitchenLangConfig(name='default' if dtype == 'float32' else dtype, embedding_dtype=dtype,
+                                    description=f'{dtype} language embeddings.')
+        for dtype in EMBEDDING_DTYPES
+    ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder-large/5")
+        self._embed = load_embed()
 
     def _info(self) -> tfds.core.DatasetInfo:
         """Dataset metadata (homepage, citation,...)."""
@@ -131,11 +160,12 @@ class KitIrlRealKitchenLang(tfds.core.GeneratorBasedBuilder):
                     'language_instruction_3': tfds.features.Text(
                         doc='Language Instruction.'
                     ),
-                    'language_embedding': tfds.features.Tensor(
+                    **embedding_features(
+                        'language_embedding',
                         shape=(3, 512),
-                        dtype=np.float32,
                         doc='Kona language embedding. '
-                            'See https://tfhub.dev/google/universal-sentence-encoder-large/5'
+                            'See https://tfhub.dev/google/universal-sentence-encoder-large/5',
+                        dtype=self.builder_config.embedding_dtype,
                     ),
                 }),
                 'episode_metadata': tfds.features.FeaturesDict({
@@ -160,22 +190,23 @@ class KitIrlRealKitchenLang(tfds.core.GeneratorBasedBuilder):
         """Generator of examples for each split."""
 
         # create list of all examples
-        raw_dirs = []
-        get_trajectorie_paths_recursive(data_path, raw_dirs)
+        raw_dirs = get_episode_paths(data_path)
         print("# of trajectories:", len(raw_dirs))
 
-        # for smallish datasets, use single-thread parsing
-        for sample in raw_dirs:
-            yield _parse_example(sample, self._embed)
-
-        # for large datasets use beam to parallelize data parsing (this will have initialization overhead)
-        # beam = tfds.core.lazy_imports.apache_beam
-        # return (
-        #         beam.Create(episode_paths)
-        #         | beam.Map(_parse_example)
-        # )
+        parse_fn = get_parse_fn(self.builder_config.name)
+        examples = parse_builder_episodes(self, raw_dirs, parse_fn, __file__, IMAGE_ENCODINGS, embed=self._embed,
+                                          embed_loader=load_embed)
+        if settings.SEARCH_INDEX and settings.USE_BEAM:
+            # the examples are a Beam PTransform that the builder runs later, there is nothing to index here
+            print("RLDS_SEARCH_INDEX is ignored with RLDS_USE_BEAM, index the built dataset with "
+                  "python3 -m conversion_utils.search_episodes build")
+        elif settings.SEARCH_INDEX:
+            # search index of the language embeddings, see conversion_utils/search_episodes.py
+            index_dir = os.path.join(settings.SEARCH_INDEX, self.name, self.builder_config.name)
+            examples = index_examples(examples, index_dir, f"{self.name}/{self.builder_config.name}")
+        return examples
 
-def _parse_example(episode_path, embed=None):
+def _parse_example(episode_path, embed=None, embedding_dtype='float32'):
     data = {}
     path = os.path.join(episode_path, "*.pickle")
     for file in glob.glob(path):
@@ -183,18 +214,22 @@ def _parse_example(episode_path, embed=None):
         # 'joint_state', 'joint_state_velocity', 'des_joint_state', 'des_joint_vel', 'end_effector_pos', 'end_effector_ori', 'des_gripper_width', 'delta_joint_state',
         # 'delta_des_joint_state', 'delta_end_effector_pos', 'delta_end_effector_ori', 'language_description', 'traj_length'
         pickle_file_path = os.path.join(episode_path, file)
-        data.update(np.load(pickle_file_path, allow_pickle=True))
+        # memory mapped from the sidecar written by conversion_utils/convert_pickles.py if there is one
+        data.update(load_pickle(pickle_file_path))
     trajectory_length = data["traj_length"]
     cam1_path = os.path.join(episode_path, "cam_1")
     cam2_path = os.path.join(episode_path, "cam_2")
-    cam1_image_vector = create_img_vector(cam1_path, trajectory_length)
-    cam2_image_vector = create_img_vector(cam2_path, trajectory_length)
-    data.update({'image': cam1_image_vector, 'wrist_image': cam2_image_vector})
+    frame_paths = {'image': get_img_paths(cam1_path, trajectory_length), 'wrist_image': get_img_paths(cam2_path, trajectory_length)}
+    features = {cam: ((250, 250, 3), 'jpeg') for cam in frame_paths}
+    data.update(load_frames(frame_paths, settings.DECODE_THREADS, features, settings.PASSTHROUGH, settings.ENCODE_FRAMES))
+
+    # compute Kona language embedding, once per episode since the instructions are the same for every step
+    language_embedding = embed(data['language_description']) if embed is not None else [np.zeros(512)]
+    # stored as float16 or int8 by the configs with that embedding_dtype
+    embedding_fields = quantize_embedding('language_embedding', language_embedding, embedding_dtype)
 
     episode = []
     for i in range(trajectory_length):
-        # compute Kona language embedding
-        language_embedding = embed(data['language_description']).numpy() if embed is not None else [np.zeros(512)]
         # action = np.append(data['delta_end_effector_pos'][i], delta_quat.as_euler("xyz"), axis=0)
         # action = np.append(action, data['des_gripper_width'][i])
         # action_abs = np.append(data['des_end_effector_pos'][i], abs_quat.as_euler("xyz"), axis=0)
@@ -229,7 +264,7 @@ def _parse_example(episode_path, embed=None):
             'language_instruction': data['language_description'][0],
             'language_instruction_2': data['language_description'][1],
             'language_instruction_3': data['language_description'][2],
-            'language_embedding': language_embedding,
+            **embedding_fields,
         })
 
     # create output data sample
@@ -244,28 +279,36 @@ def _parse_example(episode_path, embed=None):
     # if you want to skip an example for whatever reason, simply return None
     return episode_path, sample
 
-def create_img_vector(img_folder_path, trajectory_length):
-    cam_list = []
+def get_parse_fn(config_name='default'):
+    # _parse_example for the embedding dtype of a builder config, picklable for the worker processes
+    config = {config.name: config for config in KitIrlRealKitchenLang.BUILDER_CONFIGS}[config_name]
+    return functools.partial(_parse_example, embedding_dtype=config.embedding_dtype)
+
+def get_img_paths(img_folder_path, trajectory_length):
     cam_path_list = []
     for index in range(trajectory_length):
         frame_file_name = '{}.jpeg'.format(index)
-        cam_path_list.append(frame_file_name)
-        img_path = os.path.join(img_folder_path, frame_file_name)
-        img_array = cv2.cvtColor(cv2.imread(img_path), cv2.COLOR_RGB2BGR)
-        cam_list.append(img_array)
-    return cam_list
+        cam_path_list.append(os.path.join(img_folder_path, frame_file_name))
+    return cam_path_list
+
+def get_episode_paths(path):
+    # every directory containing a "cam_1" directory is an episode
+    return find_episodes(path, "cam_1", match_parent=True, manifest_dir=settings.MANIFEST_DIR,
+                         num_threads=settings.DISCOVERY_THREADS)
 
-def get_trajectorie_paths_recursive(directory, sub_dir_list):
-    for entry in os.listdir(directory):
-        full_path = os.path.join(directory, entry)
-        if os.path.isdir(full_path):
-            sub_dir_list.append(directory) if entry == "cam_1" else get_trajectorie_paths_recursive(full_path, sub_dir_list)
+def get_instructions(episode_path):
+    # instructions of an episode that are embedded, used by conversion_utils/precompute_embeddings.py
+    instructions = []
+    for file in glob.glob(os.path.join(episode_path, "*.pickle")):
+        data = load_pickle(file)
+        if 'language_description' in data:
+            instructions += list(data['language_description'])
+    return instructions
 
 if __name__ == "__main__":
-    embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder-large/5")
+    embed = load_embed()
     # create list of all examples
-    raw_dirs = []
-    get_trajectorie_paths_recursive(data_path, raw_dirs)
+    raw_dirs = get_episode_paths(data_path)
     for trajectorie_path in tqdm(raw_dirs):
         _, sample = _parse_example(trajectorie_path, embed)
         # print(sample)
\ No newline at end of file
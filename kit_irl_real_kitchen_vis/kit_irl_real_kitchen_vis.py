@@ -7,14 +7,25 @@ import glob
 import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
-import tensorflow_hub as hub
 from tqdm import tqdm
 
+from conversion_utils import settings
+from conversion_utils.columnar import load_pickle
+from conversion_utils.discovery import find_episodes
+from conversion_utils.images import load_frames
+from conversion_utils.parallel import parse_builder_episodes
+
 tf.config.set_visible_devices([], "GPU")
 data_path = "/home/marcelr/rlds_dataset_builder/data/kit_irl_real_kitchen/vis"
 # data_path = "/home/marcelr/uha_test_policy/finetune_data/non_lang_delta_des_joint_state_euler"
 # data_path = "/media/irl-admin/93a784d0-a1be-419e-99bd-9b2cd9df02dc1/preprocessed_data/upgraded_lab/quaternions_fixed/sim_to_polymetis/delta_des_joint_state"
 
+# encoding of the image feature of each observation
+IMAGE_ENCODINGS = {
+    'image_top': 'jpeg',
+    'image_side': 'jpeg',
+}
+
 class KitIrlRealKitchenVis(tfds.core.GeneratorBasedBuilder):
     """DatasetBuilder for example dataset."""
 
@@ -23,10 +34,6 @@ class KitIrlRealKitchenVis(tfds.core.GeneratorBasedBuilder):
       '1.0.0': 'Initial release.',
     }
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder-large/5")
-
     def _info(self) -> tfds.core.DatasetInfo:
         """Dataset metadata (homepage, citation,...)."""
         return self.dataset_info_from_configs(
@@ -153,20 +160,10 @@ class KitIrlRealKitchenVis(tfds.core.GeneratorBasedBuilder):
         """Generator of examples for each split."""
 
         # create list of all examples
-        raw_dirs = []
-        get_trajectorie_paths_recursive(data_path, raw_dirs)
+        raw_dirs = get_episode_paths(data_path)
         print("# of trajectories:", len(raw_dirs))
 
-        # for smallish datasets, use single-thread parsing
-        for sample in raw_dirs:
-            yield _parse_example(sample, self._embed)
-
-        # for large datasets use beam to parallelize data parsing (this will have initialization overhead)
-        # beam = tfds.core.lazy_imports.apache_beam
-        # return (
-        #         beam.Create(episode_paths)
-        #         | beam.Map(_parse_example)
-        # )
+        return parse_builder_episodes(self, raw_dirs, _parse_example, __file__, IMAGE_ENCODINGS)
 
 def _parse_example(episode_path, embed=None):
     data = {}
@@ -176,13 +173,14 @@ def _parse_example(episode_path, embed=None):
         # 'joint_state', 'joint_state_velocity', 'des_joint_state', 'des_joint_vel', 'end_effector_pos', 'end_effector_ori', 'des_gripper_width', 'delta_joint_state',
         # 'delta_des_joint_state', 'delta_end_effector_pos', 'delta_end_effector_ori', 'language_description', 'traj_length'
         pickle_file_path = os.path.join(episode_path, file)
-        data.update(np.load(pickle_file_path, allow_pickle=True))
+        # memory mapped from the sidecar written by conversion_utils/convert_pickles.py if there is one
+        data.update(load_pickle(pickle_file_path))
     trajectory_length = data["traj_length"]
     cam1_path = os.path.join(episode_path, "cam_1")
     cam2_path = os.path.join(episode_path, "cam_2")
-    cam1_image_vector = create_img_vector(cam1_path, trajectory_length)
-    cam2_image_vector = create_img_vector(cam2_path, trajectory_length)
-    data.update({'image': cam1_image_vector, 'wrist_image': cam2_image_vector})
+    frame_paths = {'image': get_img_paths(cam1_path, trajectory_length), 'wrist_image': get_img_paths(cam2_path, trajectory_length)}
+    features = {cam: ((250, 250, 3), 'jpeg') for cam in frame_paths}
+    data.update(load_frames(frame_paths, settings.DECODE_THREADS, features, settings.PASSTHROUGH, settings.ENCODE_FRAMES))
 
     episode = []
     for i in range(trajectory_length):
@@ -231,28 +229,21 @@ def _parse_example(episode_path, embed=None):
     # if you want to skip an example for whatever reason, simply return None
     return episode_path, sample
 
-def create_img_vector(img_folder_path, trajectory_length):
-    cam_list = []
+def get_img_paths(img_folder_path, trajectory_length):
     cam_path_list = []
     for index in range(trajectory_length):
         frame_file_name = '{}.jpeg'.format(index)
-        cam_path_list.append(frame_file_name)
-        img_path = os.path.join(img_folder_path, frame_file_name)
-        img_array = cv2.cvtColor(cv2.imread(img_path), cv2.COLOR_RGB2BGR)
-        cam_list.append(img_array)
-    return cam_list
+        cam_path_list.append(os.path.join(img_folder_path, frame_file_name))
+    return cam_path_list
 
-def get_trajectorie_paths_recursive(directory, sub_dir_list):
-    for entry in os.listdir(directory):
-        full_path = os.path.join(directory, entry)
-        if os.path.isdir(full_path):
-            sub_dir_list.append(directory) if entry == "cam_1" else get_trajectorie_paths_recursive(full_path, sub_dir_list)
+def get_episode_paths(path):
+    # every directory containing a "cam_1" directory is an episode
+    return find_episodes(path, "cam_1", match_parent=True, manifest_dir=settings.MANIFEST_DIR,
+                         num_threads=settings.DISCOVERY_THREADS)
 
 if __name__ == "__main__":
-    embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder-large/5")
     # create list of all examples
-    raw_dirs = []
-    get_trajectorie_paths_recursive(data_path, raw_dirs)
+    raw_dirs = get_episode_paths(data_path)
     for trajectorie_path in tqdm(raw_dirs):
-        _, sample = _parse_example(trajectorie_path, embed)
+        _, sample = _parse_example(trajectorie_path)
         # print(sample)
\ No newline at end of file
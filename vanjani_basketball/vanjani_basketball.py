@@ -1,3 +1,5 @@
+import dataclasses
+import functools
 import os
 import cv2
 from typing import Iterator, Tuple, Any
@@ -5,16 +7,35 @@ from scipy.spatial.transform import Rotation
 
 import glob
 import numpy as np
-import torch
 import tensorflow as tf
 import tensorflow_datasets as tfds
-import tensorflow_hub as hub
 from tqdm import tqdm
 import re
 
+from conversion_utils import settings
+from conversion_utils.discovery import find_episodes
+from conversion_utils.embedding_storage import EMBEDDING_DTYPES, embedding_features, quantize_embedding
+from conversion_utils.images import load_frames
+from conversion_utils.parallel import parse_builder_episodes
+from conversion_utils.streams import submit_streams
+
 tf.config.set_visible_devices([], "GPU")
 data_path = "/home/vanjani/codes/data/final_data/basketball"
 
+# encoding of the image feature of each observation
+IMAGE_ENCODINGS = {
+    'image_depthai_14': 'png',
+    'image_depthai_18': 'png',
+    'image_gopro': 'png',
+    'image_realsense': 'png',
+}
+
+@dataclasses.dataclass
+class VanjaniBasketballConfig(tfds.core.BuilderConfig):
+    """Storage variant of the dataset, every variant is built into its own directory."""
+    # storage dtype of the (zero) language embeddings: float32, float16 or int8 (with a float32 scale per vector)
+    embedding_dtype: str = 'float32'
+
 class VanjaniBasketball(tfds.core.GeneratorBasedBuilder):
     """DatasetBuilder for example dataset."""
 
@@ -22,10 +43,12 @@ class VanjaniBasketball(tfds.core.GeneratorBasedBuilder):
     RELEASE_NOTES = {
       '1.0.0': 'Initial release.',
     }
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder-large/5")
+    # a plain tfds build builds all three, build the float32 one with tfds build --config default
+    BUILDER_CONFIGS = [
+        VanjaniBasketballConfig(name='default' if dtype == 'float32' else dtype, embedding_dtype=dtype,
+                                description=f'{dtype} language embeddings.')
+        for dtype in EMBEDDING_DTYPES
+    ]
 
     def _info(self) -> tfds.core.DatasetInfo:
         """Dataset metadata (homepage, citation,...)."""
@@ -138,11 +161,12 @@ class VanjaniBasketball(tfds.core.GeneratorBasedBuilder):
                         dtype=np.bool_,
                         doc='True on last step of the episode if it is a terminal step, True for demos.'
                     ),
-                    'language_embedding': tfds.features.Tensor(
+                    **embedding_features(
+                        'language_embedding',
                         shape=(1, 512),
-                        dtype=np.float32,
                         doc='Kona language embedding. '
-                            'See https://tfhub.dev/google/universal-sentence-encoder-large/5'
+                            'See https://tfhub.dev/google/universal-sentence-encoder-large/5',
+                        dtype=self.builder_config.embedding_dtype,
                     ),
                 }),
                 'episode_metadata': tfds.features.FeaturesDict({
@@ -167,45 +191,46 @@ class VanjaniBasketball(tfds.core.GeneratorBasedBuilder):
         """Generator of examples for each split."""
 
         # create list of all examples
-        raw_dirs = []
-        get_trajectorie_paths_recursive(data_path, raw_dirs)
+        raw_dirs = get_episode_paths(data_path)
         print("# of trajectories:", len(raw_dirs))
         
-        # for smallish datasets, use single-thread parsing
-        for sample in raw_dirs:
-            yield _parse_example(sample, self._embed)
-
-        # for large datasets use beam to parallelize data parsing (this will have initialization overhead)
-        # beam = tfds.core.lazy_imports.apache_beam
-        # return (
-        #         beam.Create(episode_paths)
-        #         | beam.Map(_parse_example)
-        # )
+        parse_fn = get_parse_fn(self.builder_config.name)
+        return parse_builder_episodes(self, raw_dirs, parse_fn, __file__, IMAGE_ENCODINGS)
 
-def _parse_example(episode_path, embed=None):
+def _parse_example(episode_path, embed=None, embedding_dtype='float32'):
     data = {}
-    
+    frame_paths = {}
+    stream_paths = {}
+
     for data_field in os.listdir(episode_path):
         data_field_full_path = os.path.join(episode_path, data_field)
         if os.path.isdir(data_field_full_path) and data_field == "images":
             # load images
             for image_dir in os.listdir(data_field_full_path):
                 image_dir_full_path = os.path.join(data_field_full_path, image_dir)
-                cam1_image_vector = create_img_vector(image_dir_full_path)
-                data.update({image_dir: cam1_image_vector})
+                frame_paths[image_dir] = get_img_paths(image_dir_full_path)
         else:
-            # load robot data
-            data.update({data_field[:data_field.find(".")]: torch.load(data_field_full_path).numpy()})
+            # robot data
+            stream_paths[data_field[:data_field.find(".")]] = data_field_full_path
+
+    # the robot data is loaded in a background thread while the frames are decoded, memory mapped from the
+    # numpy copies of the streams in RLDS_STREAM_CACHE, which are written on the first build
+    streams = submit_streams(stream_paths, settings.STREAM_CACHE)
+
+    features = {cam: ((512, 512, 3), 'png') for cam in frame_paths}
+    data.update(load_frames(frame_paths, settings.DECODE_THREADS, features, settings.PASSTHROUGH, settings.ENCODE_FRAMES))
+    data.update(streams.result())
 
     # print(data.keys())
     trajectory_length = len(data["follower_joint_pos"]) if len(data["follower_joint_pos"]) < len(data["GoPro"]) else len(data["GoPro"])
     # print("traj_len:", len(data["follower_joint_pos"]))
     # print("GoPro len:", len(data["GoPro"]))
 
+    # no language, zero Kona language embedding, stored as float16 or int8 by the configs with that embedding_dtype
+    embedding_fields = quantize_embedding('language_embedding', [np.zeros(512)], embedding_dtype)
+
     episode = []
     for i in range(trajectory_length):
-        # compute Kona language embedding
-        language_embedding = [np.zeros(512)]
         action = np.append(data['leader_ee_pos'][i], data['leader_gripper_state'][i])
         action_joint = np.append(data['leader_joint_pos'][i], data['leader_gripper_state'][i])
 
@@ -233,7 +258,7 @@ def _parse_example(episode_path, embed=None):
             'is_first': i == 0,
             'is_last': i == (trajectory_length - 1),
             'is_terminal': i == (trajectory_length - 1),
-            'language_embedding': language_embedding,
+            **embedding_fields,
         })
 
     # create output data sample
@@ -253,31 +278,28 @@ def sorted_alphanumeric(data):
     alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ] 
     return sorted(data, key=alphanum_key)
 
-def create_img_vector(img_folder_path):
-    cam_list = []
+def get_img_paths(img_folder_path):
     cam_path_list = []
     dir_list_sorted = sorted_alphanumeric(os.listdir(img_folder_path))
     for img_name in dir_list_sorted:
         ext = img_name[img_name.find("."):]
         if ext == '.png' or ext == '.jpg' or ext == '.jpeg':
-            cam_path_list.append(img_name)
-            img_path = os.path.join(img_folder_path, img_name)
-            img_array = cv2.cvtColor(cv2.imread(img_path), cv2.COLOR_RGB2BGR)
-            cam_list.append(img_array)
-    return cam_list
+            cam_path_list.append(os.path.join(img_folder_path, img_name))
+    return cam_path_list
+
+def get_parse_fn(config_name='default'):
+    # _parse_example for the embedding dtype of a builder config, picklable for the worker processes
+    config = {config.name: config for config in VanjaniBasketball.BUILDER_CONFIGS}[config_name]
+    return functools.partial(_parse_example, embedding_dtype=config.embedding_dtype)
 
-def get_trajectorie_paths_recursive(directory, sub_dir_list):
-    for entry in os.listdir(directory):
-        full_path = os.path.join(directory, entry)
-        if os.path.isdir(full_path):
-            sub_dir_list.append(directory) if entry == "images" else get_trajectorie_paths_recursive(full_path, sub_dir_list)
-    # return subdirectories
+def get_episode_paths(path):
+    # every directory containing an "images" directory is an episode
+    return find_episodes(path, "images", match_parent=True, manifest_dir=settings.MANIFEST_DIR,
+                         num_threads=settings.DISCOVERY_THREADS)
 
 if __name__ == "__main__":
-    embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder-large/5")
     # create list of all examples
-    raw_dirs = []
-    get_trajectorie_paths_recursive(data_path, raw_dirs)
+    raw_dirs = get_episode_paths(data_path)
     for trajectorie_path in tqdm(raw_dirs):
-        _, sample = _parse_example(trajectorie_path, embed)
+        _, sample = _parse_example(trajectorie_path)
         # print(sample)
\ No newline at end of file